@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+import numpy as np
+import pandas as pd
+import sqlalchemy as alch
+import exercise_util
+import exercise_util_qc as qc
+import exercise_util_profile as prof
+import q2_close_ended
+import q2_open_ended
+import q3_close_ended
+
+# Number of rows used for the benchmarks unless given in the command line.
+N_ROWS = 100000
+
+# Returns best wall time (seconds) of func over a number of repeats.
+def time_it(func, *args, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+# Build string columns with the dirty patterns handled by clean_string.
+def sample_strings(n_rows):
+    rng = np.random.default_rng(0)
+
+    receipt_ids = pd.Series(
+        [str(uuid.UUID(int=int(x))) for x in rng.integers(0, 2**63, n_rows)],
+        name='receipt_id',
+    )
+    receipt_ids[rng.random(n_rows) < 0.05] = np.nan
+
+    stores = pd.Series(
+        rng.choice(['WALMART', ' ALDI', 'TARGET  ', 'DOLLAR GENERAL STORE',
+                    np.nan], n_rows),
+        name='store_name',
+    )
+
+    genders = pd.Series(
+        rng.choice(['female', 'male', 'Non-Binary ', 'not_listed',
+                    'Prefer not to say', 'not_specified', np.nan], n_rows),
+        name='gender',
+    )
+
+    return [(receipt_ids, 'receipt_id'), (stores, None), (genders, None)]
+
+# Compare the per-row clean_string loop with the vectorized version.
+def bench_clean_string(n_rows=N_ROWS):
+
+    print(f'Benchmark clean_string on {n_rows} rows...')
+    for series, regex_for in sample_strings(n_rows):
+        t_loop, s_loop = time_it(qc.clean_string_loop, series, regex_for)
+        t_vect, s_vect = time_it(qc.clean_string, series, regex_for)
+
+        # Both versions need to return the same values
+        pd.testing.assert_series_equal(s_loop, s_vect, check_dtype=False)
+
+        print(f'\t... {series.name}: loop {t_loop:.3f}s, ',
+              f'vectorized {t_vect:.3f}s ({t_loop / t_vect:.1f}x)', sep='')
+
+# Rows per table of each synthetic scale.
+SCALES = {
+    '10k': 10000,
+    '100k': 100000,
+    '1m': 1000000,
+    '10m': 10000000,
+}
+
+# Synthetic CSV, databases and saved results of the scale benchmark.
+PATH_BENCH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'benchmark')
+
+# Share of rows with each dirty pattern in the synthetic CSV.
+P_DIRTY = 0.02
+P_DUP_RECEIPT = 0.3
+
+# Values of the synthetic products, with the ones the questions look for.
+SYNTH_CATEGORIES = {
+    'Health & Wellness': ['Medicines & Treatments', 'Bath & Body', 
+                          'Hair Care', 'Skin Care'],
+    'Snacks': ['Dips & Salsa', 'Chips', 'Candy', 'Nuts & Seeds'],
+    'Beverages': ['Soda', 'Water', 'Juice'],
+}
+SYNTH_CATEGORY_3 = ['Hummus', 'Salsa', 'Guacamole', 'Cheese Dip', 
+                    'Dip Mixes', 'Bean Dip', 'Other Dips', 'Tortilla Chips']
+SYNTH_BRANDS = ['TOSTITOS', 'PACE', 'DOVE', 'CVS', 'TRIDENT', 'FRITOS', 
+                'GOOD FOODS', 'COORS LIGHT', 'TRESEMME', 'BRAND NOT KNOWN']
+SYNTH_STORES = ['WALMART', 'ALDI', 'TARGET', 'DOLLAR GENERAL STORE', 
+                'KROGER', 'CVS']
+SYNTH_STATES = ['WI', 'CA', 'TX', 'NY', 'FL', 'NC', 'OH', 'IL']
+SYNTH_LANGUAGES = ['en', 'es-419']
+SYNTH_GENDERS = ['female', 'male', 'Non-Binary', 'non_binary', 
+                 'Prefer not to say', 'prefer_not_to_say', 'not_listed', 
+                 'not_specified', 'transgender', 'unknown']
+
+# Random hex identifiers, with dashes after the given character counts, 
+# e.g. [8, 4, 4, 4, 12] for UUIDs. Built as a byte array, no per-row loop.
+def random_ids(rng, n, groups):
+    c_hex = sum(groups)
+    hex_chars = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+    arr_hex = hex_chars[rng.integers(0, 16, (n, c_hex))]
+    
+    arr_ids = np.full((n, c_hex + len(groups) - 1), ord('-'), dtype=np.uint8)
+    cols = np.concatenate([np.arange(start, start + size) + i for i, (start, size) 
+                           in enumerate(zip(np.cumsum([0] + groups[:-1]), groups))])
+    arr_ids[:, cols] = arr_hex
+    return arr_ids.view(f'S{arr_ids.shape[1]}').ravel().astype(str)
+
+'''
+Random timestamps from start over a number of days, written in the mixed
+formats of the source CSV. UTC columns mix 'T...Z' and ' ... Z' spellings,
+others mix ISO8601 without a time zone and dates only. A share of both is
+in a format only dateutil parses.
+'''
+def random_dates(rng, n, start, days, utc=True):
+    values = np.datetime64(start, 'ms') + rng.integers(
+        0, days * 86400000, n).astype('timedelta64[ms]')
+    kind = rng.random(n)
+    bool_other = kind >= 1 - P_DIRTY
+    
+    if utc:
+        arr_dates = np.datetime_as_string(values, unit='ms', timezone='UTC')
+        bool_space = kind < 0.5
+        arr_dates[bool_space] = np.char.add(np.char.replace(
+            np.datetime_as_string(values[bool_space], unit='ms'), 'T', ' '),
+            ' Z')
+        fmt_other = '%b %d, %Y %H:%M UTC'
+    else:
+        arr_dates = np.datetime_as_string(values, unit='D')
+        bool_iso = kind < 0.3
+        arr_dates[bool_iso] = np.datetime_as_string(values[bool_iso], unit='s')
+        fmt_other = '%b %d, %Y'
+    
+    arr_dates = arr_dates.astype(object)
+    arr_dates[bool_other] = pd.DatetimeIndex(values[bool_other]).strftime(
+        fmt_other)
+    return arr_dates
+
+# Set a share of a column to a dirty value, e.g. 'zero' or whitespace.
+def add_dirty(rng, values, dirty, p=P_DIRTY):
+    values = values.astype(object)
+    values[rng.random(values.shape[0]) < p] = dirty
+    return values
+
+'''
+Write PRODUCTS, TRANSACTION and USER CSV files of n_rows each to path_csv,
+with the columns of TABLES and the dirty patterns handled by the QC:
+'zero' quantities, '-1' barcodes, whitespace values, padded strings, 
+receipts scanned twice with conflicting quantity and sale, duplicated 
+products and users, and mixed datetime formats.
+'''
+def generate_source_csv(path_csv, n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(path_csv, exist_ok=True)
+    
+    # Products, with duplicated barcodes for qc_by_row
+    barcodes = 10**11 + rng.choice(9 * 10**11, n_rows, replace=False)
+    category_1 = rng.choice(list(SYNTH_CATEGORIES), n_rows)
+    category_2 = np.empty(n_rows, dtype=object)
+    for cat_1, arr_cat_2 in SYNTH_CATEGORIES.items():
+        bool_cat = category_1 == cat_1
+        category_2[bool_cat] = rng.choice(arr_cat_2, bool_cat.sum())
+    
+    df_products = pd.DataFrame({
+        'category_1': category_1,
+        'category_2': category_2,
+        'category_3': add_dirty(rng, rng.choice(SYNTH_CATEGORY_3, n_rows), 
+                                np.nan, 0.1),
+        'category_4': add_dirty(rng, rng.choice(['Dips', 'Salsa'], n_rows), 
+                                np.nan, 0.5),
+        'manufacturer': add_dirty(
+            rng, np.char.add('MANUFACTURER ', 
+                             rng.integers(0, 100, n_rows).astype(str)), ' '),
+        'brand': add_dirty(rng, rng.choice(SYNTH_BRANDS, n_rows), ' '),
+        'barcode': add_dirty(rng, barcodes, np.nan),
+    })
+    df_products = pd.concat([df_products, df_products.sample(
+        frac=P_DIRTY, random_state=seed)], ignore_index=True)
+    
+    # Users, with padded genders and duplicated ids
+    user_ids = random_ids(rng, n_rows, [24])
+    df_users = pd.DataFrame({
+        'id': user_ids,
+        'created_date': random_dates(rng, n_rows, '2014-01-01', 3650),
+        'birth_date': add_dirty(
+            rng, random_dates(rng, n_rows, '1900-01-01', 45000), np.nan, 0.05),
+        'state': add_dirty(rng, rng.choice(SYNTH_STATES, n_rows), np.nan),
+        'language': add_dirty(rng, rng.choice(SYNTH_LANGUAGES, n_rows), np.nan),
+        'gender': add_dirty(rng, np.char.add(
+            rng.choice(SYNTH_GENDERS, n_rows), 
+            rng.choice(['', ' '], n_rows)), np.nan),
+    })
+    df_users = pd.concat([df_users, df_users.sample(
+        frac=P_DIRTY, random_state=seed)], ignore_index=True)
+    
+    # Transactions, where a share of receipts are scanned twice: one row 
+    # has quantity 'zero' and the other a blank sale, like the source data
+    n_receipts = n_rows - int(n_rows * P_DUP_RECEIPT / 2)
+    i_receipt = np.concatenate([
+        np.arange(n_receipts), 
+        rng.choice(n_receipts, n_rows - n_receipts, replace=False)])
+    receipt_ids = random_ids(rng, n_receipts, [8, 4, 4, 4, 12])[i_receipt]
+    scan_dates = random_dates(rng, n_receipts, '2024-06-01', 90)[i_receipt]
+    purchase_dates = random_dates(rng, n_receipts, '2024-06-01', 90, 
+                                  utc=False)[i_receipt]
+    
+    final_quantity = rng.choice(['1.00', '2.00', '3.00', '1'], n_rows)
+    final_sale = np.round(rng.gamma(2, 3, n_rows), 2).astype(str)
+    bool_dup = pd.Series(i_receipt).duplicated(keep=False).values
+    bool_first = bool_dup & ~pd.Series(i_receipt).duplicated().values
+    final_quantity = add_dirty(rng, final_quantity, 'zero')
+    final_quantity[bool_first] = 'zero'
+    final_sale = add_dirty(rng, final_sale, ' ')
+    final_sale[bool_dup & ~bool_first] = ' '
+    
+    # Users and products from the tables, plus some not in them
+    tx_users = add_dirty(rng, rng.choice(user_ids, n_rows), 
+                         random_ids(rng, 1, [24])[0])
+    df_transactions = pd.DataFrame({
+        'receipt_id': receipt_ids,
+        'purchase_date': purchase_dates,
+        'scan_date': scan_dates,
+        'store_name': rng.choice(SYNTH_STORES + [' ALDI', 'TARGET  '], 
+                                 n_receipts)[i_receipt],
+        'user_id': tx_users[i_receipt],
+        'barcode': add_dirty(rng, rng.choice(barcodes, n_rows), -1),
+        'final_quantity': final_quantity,
+        'final_sale': final_sale,
+    })
+    
+    for table, df in [('PRODUCTS_TAKEHOME', df_products), 
+                      ('USER_TAKEHOME', df_users),
+                      ('TRANSACTION_TAKEHOME', df_transactions)]:
+        df.columns = [col.upper() for col in exercise_util.TABLES[table]]
+        df.to_csv(os.path.join(path_csv, table + '.csv'), index=False)
+
+# Question modules with a run_query(engine) function.
+QUERY_MODULES = [q2_close_ended, q3_close_ended, q2_open_ended]
+
+# Dispose a shared engine of exercise_util without disconnect_db, which 
+# offers to delete the sample database and its DuckDB copy.
+def dispose_engine(engine):
+    engine.dispose()
+    for engine_url in [url for url, shared in exercise_util.ENGINES.items()
+                       if shared is engine]:
+        del exercise_util.ENGINES[engine_url]
+
+# Point PATH_CSV at the synthetic CSV of a scale, generated on first use.
+def use_bench_csv(scale):
+    path_csv = os.path.join(PATH_BENCH, scale) + os.sep
+    if not os.path.exists(os.path.join(path_csv, 'USER_TAKEHOME.csv')):
+        print(f'Generating {scale} rows per table...')
+        generate_source_csv(path_csv, SCALES[scale])
+    exercise_util.PATH_CSV = path_csv
+
+'''
+URL of the SQLite database of a scale under PATH_BENCH, created from the 
+synthetic CSV on first use. Query results are not cached, so every query
+of a benchmark runs.
+'''
+def get_bench_db(scale):
+    use_bench_csv(scale)
+    exercise_util.PATH_CACHE = None
+    exercise_util.PATH_STAGING = os.path.join(PATH_BENCH, f'staging_{scale}')
+    
+    engine_url = f'sqlite:///{os.path.join(PATH_BENCH, scale)}.db'
+    if not exercise_util.database_exists(engine_url):
+        exercise_util.create_sample_db(engine_url)
+    return engine_url
+
+'''
+Time each question query without and with the indexes from INDEXES, on 
+the database of a scale. The queries join the loaded tables, which is 
+what the indexes are for, instead of reading the fact table.
+'''
+def bench_indexes(scale='100k'):
+
+    engine = alch.create_engine(get_bench_db(scale))
+    use_fact_table = exercise_util.USE_FACT_TABLE
+    exercise_util.USE_FACT_TABLE = False
+    timings = {}
+    try:
+        for label, set_indexes in [('before', exercise_util.drop_indexes),
+                                   ('after', exercise_util.create_indexes)]:
+            set_indexes(engine)
+            for module in QUERY_MODULES:
+                t_query, _ = time_it(module.run_query, engine)
+                timings.setdefault(module.__name__, {})[label] = t_query
+    finally:
+        exercise_util.USE_FACT_TABLE = use_fact_table
+        exercise_util.create_indexes(engine)
+        engine.dispose()
+
+    print(f'Query timings without and with indexes, {scale} rows per table...')
+    for name, t in timings.items():
+        print(f'\t... {name}: before {t["before"]:.3f}s, ',
+              f'after {t["after"]:.3f}s ({t["before"] / t["after"]:.1f}x)',
+              sep='')
+
+'''
+Check the set-based q2_open_ended query against the original correlated
+subquery on the database of a scale, then time both.
+'''
+def bench_q2_open_ended(scale='10k'):
+
+    engine = alch.create_engine(get_bench_db(scale))
+    with engine.connect() as conn:
+        t_corr, df_corr = time_it(
+            pd.read_sql, q2_open_ended.SQL_QUERY_CORRELATED, conn)
+        t_set, df_set = time_it(pd.read_sql, q2_open_ended.SQL_QUERY, conn)
+
+    pd.testing.assert_frame_equal(df_corr, df_set, check_dtype=False)
+
+    print(f'q2_open_ended returns the same {len(df_set)} rows, {scale} rows',
+          'per table...')
+    print(f'\t... correlated {t_corr:.3f}s, set-based {t_set:.3f}s ',
+          f'({t_corr / t_set:.1f}x)', sep='')
+    engine.dispose()
+
+# Modules exercise_util imports only when building or rendering, and the 
+# budget in seconds for a cold import of exercise_util.
+LAZY_MODULES = ['exercise_util_qc', 'pandera', 'sqlalchemy_utils', 
+                'plotly', 'PIL', 'pkg_resources']
+IMPORT_TIME_LIMIT = 1.0
+
+'''
+Time a cold import of exercise_util in a new interpreter and check that
+none of LAZY_MODULES were loaded by it.
+'''
+def bench_import():
+    
+    script = ('import sys, time; start = time.perf_counter(); '
+              'import exercise_util; secs = time.perf_counter() - start; '
+              f'print(secs, *[m for m in {LAZY_MODULES!r} if m in sys.modules])')
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    
+    times = []
+    for _ in range(3):
+        output = subprocess.run([sys.executable, '-c', script], 
+                                cwd=script_dir, capture_output=True, 
+                                text=True, check=True).stdout
+        secs, *loaded = output.split()
+        times.append(float(secs))
+    
+    assert not loaded, f'exercise_util imported {loaded} at import'
+    
+    print(f'Import of exercise_util: best {min(times):.3f}s, ',
+          f'limit {IMPORT_TIME_LIMIT:.3f}s', sep='')
+    assert min(times) < IMPORT_TIME_LIMIT, 'Import is over the time limit'
+
+'''
+Benchmark the load path and the question queries on synthetic data of 
+each scale. Per scale, the CSV are generated once and kept under 
+PATH_BENCH, then a new SQLite database is created from them with the stage
+timings of exercise_util_profile, and each run_query is timed without the
+query cache. Results are saved as JSON under PATH_BENCH/results and 
+compared with the previous run.
+'''
+def bench_scale(scales=('10k',), workers=None, chunksize=None):
+    
+    path_results = os.path.join(PATH_BENCH, 'results')
+    arr_previous = sorted(glob.glob(os.path.join(path_results, '*.json')))
+    results = {
+        'started_at': datetime.datetime.now().isoformat(),
+        'commit': get_commit(),
+        'workers': workers,
+        'chunksize': chunksize,
+        'scales': {},
+    }
+    
+    # Stage timings are recorded by the profiler, also in QC workers. 
+    # tracemalloc is left off as it slows down every stage.
+    os.environ['EXERCISE_PROFILE'] = '1'
+    os.environ['EXERCISE_PROFILE_MEMORY'] = '0'
+    prof.PROFILE_ENABLED = True
+    prof.PROFILE_MEMORY = False
+    exercise_util.PATH_CACHE = None
+    
+    # Every run cleans the CSV, staged tables would skip QC
+    exercise_util.PATH_STAGING = None
+    
+    for scale in scales:
+        n_rows = SCALES[scale]
+        path_csv = os.path.join(PATH_BENCH, scale) + os.sep
+        
+        start = time.perf_counter()
+        if not os.path.exists(os.path.join(path_csv, 'USER_TAKEHOME.csv')):
+            print(f'Generating {scale} rows per table...')
+            generate_source_csv(path_csv, n_rows)
+        secs_generate = time.perf_counter() - start
+        
+        # Load a new database from the synthetic CSV
+        path_db = os.path.join(PATH_BENCH, f'{scale}.db')
+        if os.path.exists(path_db):
+            os.remove(path_db)
+        exercise_util.PATH_CSV = path_csv
+        prof.PROFILE_REPORT = os.path.join(PATH_BENCH, f'profile_{scale}.json')
+        
+        start = time.perf_counter()
+        exercise_util.create_sample_db(f'sqlite:///{path_db}', workers, 
+                                       chunksize)
+        secs_load = time.perf_counter() - start
+        with open(prof.PROFILE_REPORT) as f:
+            stage_secs = json.load(f)['stage_secs']
+        
+        engine = exercise_util.get_engine(f'sqlite:///{path_db}')
+        query_secs = {}
+        for module in QUERY_MODULES:
+            query_secs[module.__name__], _ = time_it(module.run_query, engine)
+        dispose_engine(engine)
+        
+        results['scales'][scale] = {
+            'rows': n_rows,
+            'generate_secs': secs_generate,
+            'load_secs': secs_load,
+            'stage_secs': stage_secs,
+            'query_secs': query_secs,
+        }
+    
+    os.makedirs(path_results, exist_ok=True)
+    path_json = os.path.join(
+        path_results, datetime.datetime.now().strftime('%Y%m%d_%H%M%S.json'))
+    with open(path_json, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Benchmark results written to {path_json}')
+    
+    previous = None
+    if arr_previous:
+        with open(arr_previous[-1]) as f:
+            previous = json.load(f)
+    print_scale_results(results, previous)
+
+# Current git commit of the repository, None outside of git.
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], 
+                              cwd=PATH_BENCH.rsplit(os.sep, 1)[0],
+                              capture_output=True, text=True, 
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Print load and query timings per scale, and the ratio to a previous run.
+def print_scale_results(results, previous=None):
+    
+    print('Scale benchmark timings...')
+    for scale, result in results['scales'].items():
+        result_prev = (previous or {}).get('scales', {}).get(scale, {})
+        timings = {'load': result['load_secs'], **result['stage_secs'], 
+                   **result['query_secs']}
+        timings_prev = {'load': result_prev.get('load_secs'), 
+                        **result_prev.get('stage_secs', {}), 
+                        **result_prev.get('query_secs', {})}
+        
+        print(f'\t{scale} ({result["rows"]} rows per table)')
+        for name, secs in timings.items():
+            line = f'\t\t... {name}: {secs:.3f}s'
+            if timings_prev.get(name):
+                line += (f' (previous {timings_prev[name]:.3f}s, '
+                         f'{secs / timings_prev[name]:.2f}x)')
+            print(line)
+
+'''
+QC every table of the synthetic data of a scale with the 'default' and 
+'lean' dtype modes. Checks that both return the same values, and prints 
+the memory of each table after QC with the peak traced memory of its QC.
+'''
+def bench_dtypes(scale='100k'):
+    import tracemalloc
+    
+    use_bench_csv(scale)
+    
+    dtype_mode = qc.DTYPE_MODE
+    tracemalloc.start()
+    print(f'QC memory by dtype mode on {scale} rows per table...')
+    try:
+        for table in exercise_util.TABLES.keys():
+            results = {}
+            for mode in ['default', 'lean']:
+                qc.DTYPE_MODE = mode
+                # Peak over what is held already, e.g. the other result
+                c_held = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                start = time.perf_counter()
+                df = exercise_util.qc_source_csv(table)
+                secs = time.perf_counter() - start
+                results[mode] = (df, qc.get_memory(df), 
+                                 tracemalloc.get_traced_memory()[1] - c_held,
+                                 secs)
+            
+            # Same values once nulls and dtypes are made alike
+            df_default, df_lean = results['default'][0], results['lean'][0]
+            pd.testing.assert_frame_equal(
+                df_default.astype(object).where(df_default.notna(), None),
+                df_lean.astype(object).where(df_lean.notna(), None))
+            
+            print(f'\t... {table}')
+            for mode, (_, c_bytes, c_peak, secs) in results.items():
+                print(f'\t\t... {mode}: {c_bytes / 2**20:,.1f} MB after QC,',
+                      f'peak {c_peak / 2**20:,.1f} MB, {secs:.2f}s')
+    finally:
+        qc.DTYPE_MODE = dtype_mode
+        tracemalloc.stop()
+
+'''
+Create the database of a scale from its CSV, which stages the cleaned 
+tables, then again from the staged tables. Checks that both databases hold
+the same tables and prints the time of each.
+'''
+def bench_staging(scale='100k'):
+    import shutil
+    
+    use_bench_csv(scale)
+    exercise_util.PATH_CACHE = None
+    exercise_util.PATH_STAGING = os.path.join(PATH_BENCH, f'staging_{scale}')
+    shutil.rmtree(exercise_util.PATH_STAGING, ignore_errors=True)
+    
+    timings, tables = {}, {}
+    for label in ['csv', 'staged']:
+        path_db = os.path.join(PATH_BENCH, f'{scale}_{label}.db')
+        if os.path.exists(path_db):
+            os.remove(path_db)
+        
+        start = time.perf_counter()
+        exercise_util.create_sample_db(f'sqlite:///{path_db}')
+        timings[label] = time.perf_counter() - start
+        
+        engine = alch.create_engine(f'sqlite:///{path_db}')
+        with engine.connect() as conn:
+            tables[label] = {table: pd.read_sql(alch.text(
+                f'SELECT * FROM {table} ORDER BY 1, 2, 3'), conn)
+                for table in exercise_util.TABLES.keys()}
+        engine.dispose()
+    
+    for table in exercise_util.TABLES.keys():
+        pd.testing.assert_frame_equal(tables['csv'][table], 
+                                      tables['staged'][table])
+    
+    print(f'Create database on {scale} rows per table, same tables...')
+    print(f'\t... from CSV {timings["csv"]:.3f}s, ',
+          f'from staging {timings["staged"]:.3f}s ',
+          f'({timings["csv"] / timings["staged"]:.1f}x)', sep='')
+
+'''
+Run every question on the SQLite database of a scale and on its DuckDB 
+copy, with and without the fact table. Checks that both backends return
+the same rows, in any order of ties, and prints the time of each query.
+'''
+def bench_duckdb(scale='100k'):
+    
+    sqlite_url = get_bench_db(scale)
+    exercise_util.DUCKDB_PATH = os.path.join(PATH_BENCH, f'{scale}.duckdb')
+    engines = {'sqlite': exercise_util.get_engine(sqlite_url),
+               'duckdb': exercise_util.get_duckdb_engine(sqlite_url)}
+    
+    use_fact_table = exercise_util.USE_FACT_TABLE
+    timings = {}
+    try:
+        for fact in [True, False]:
+            exercise_util.USE_FACT_TABLE = fact
+            for module in QUERY_MODULES:
+                name = module.__name__ + (' (fact table)' if fact else '')
+                results = {}
+                for backend, engine in engines.items():
+                    t_query, (df, _) = time_it(module.run_query, engine)
+                    timings.setdefault(name, {})[backend] = t_query
+                    results[backend] = df.sort_values(
+                        list(df.columns)).reset_index(drop=True)
+                
+                pd.testing.assert_frame_equal(results['sqlite'], 
+                                              results['duckdb'], 
+                                              check_dtype=False)
+    finally:
+        exercise_util.USE_FACT_TABLE = use_fact_table
+        for engine in engines.values():
+            dispose_engine(engine)
+    
+    print(f'Query timings on SQLite and DuckDB, {scale} rows per table,',
+          'same results...')
+    for name, t in timings.items():
+        print(f'\t... {name}: sqlite {t["sqlite"]:.3f}s, ',
+              f'duckdb {t["duckdb"]:.3f}s ',
+              f'({t["sqlite"] / t["duckdb"]:.1f}x)', sep='')
+
+BENCHMARKS = {
+    'clean_string': bench_clean_string,
+    'indexes': bench_indexes,
+    'q2_open_ended': bench_q2_open_ended,
+    'import': bench_import,
+    'scale': bench_scale,
+    'dtypes': bench_dtypes,
+    'staging': bench_staging,
+    'duckdb': bench_duckdb,
+}
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('benchmark', choices=BENCHMARKS.keys())
+    arg_parser.add_argument('--rows', type=int, default=N_ROWS)
+    arg_parser.add_argument('--scales', nargs='+', choices=SCALES.keys(),
+                            default=['10k'])
+    arg_parser.add_argument('--workers', type=int, default=None)
+    arg_parser.add_argument('--chunksize', type=int, default=None)
+    args = arg_parser.parse_args()
+
+    if args.benchmark == 'clean_string':
+        bench_clean_string(args.rows)
+    elif args.benchmark == 'scale':
+        bench_scale(args.scales, args.workers, args.chunksize)
+    elif args.benchmark == 'q2_open_ended':
+        bench_q2_open_ended(args.scales[-1])
+    elif args.benchmark == 'indexes':
+        bench_indexes(args.scales[-1])
+    elif args.benchmark == 'dtypes':
+        bench_dtypes(args.scales[-1])
+    elif args.benchmark == 'staging':
+        bench_staging(args.scales[-1])
+    elif args.benchmark == 'duckdb':
+        bench_duckdb(args.scales[-1])
+    else:
+        BENCHMARKS[args.benchmark]()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import glob
+import importlib
+import os
+import time
+import exercise_util
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Number of threads running queries at once. None runs all at once.
+REPORT_WORKERS = None
+
+'''
+Find every question module next to this script (q*.py) that has a
+run_query(engine) function. Returns them as sheet_name: module, where the
+sheet name is the module name in title case, e.g. Q2_Close_Ended.
+'''
+def discover_reports():
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+
+    reports = {}
+    for path in sorted(glob.glob(os.path.join(script_dir, 'q*.py'))):
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        module = importlib.import_module(module_name)
+        if hasattr(module, 'run_query'):
+            sheet_name = '_'.join(
+                part.capitalize() for part in module_name.split('_'))
+            reports[sheet_name] = module
+    return reports
+
+# Run a question query and return its results with the seconds it took.
+def timed_query(module, engine):
+    start = time.perf_counter()
+    df_query_result, fig = module.run_query(engine)
+    return df_query_result, fig, time.perf_counter() - start
+
+'''
+Run every question over the same engine. Queries run concurrently in a
+thread pool, each on its own pooled connection. Charts are rendered in the
+background as results come in, and all sheets are written to the workbook
+at once.
+'''
+def run_reports(engine, reports=None):
+    if reports is None:
+        reports = discover_reports()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=REPORT_WORKERS) as executor:
+        futures = {executor.submit(timed_query, module, engine): sheet_name
+                   for sheet_name, module in reports.items()}
+        
+        # Charts start rendering as soon as their query is done
+        results = {}
+        for future in as_completed(futures):
+            sheet_name = futures[future]
+            df_query_result, fig, secs = results[sheet_name] = future.result()
+            exercise_util.queue_output(df_query_result, sheet_name, fig)
+    secs_queries = time.perf_counter() - start
+
+    exercise_util.flush_output()
+
+    print('Report timings...')
+    for sheet_name in reports.keys():
+        secs = results[sheet_name][2]
+        print(f'\t... {sheet_name}: query {secs:.3f}s')
+    print(f'\t... All queries: {secs_queries:.3f}s,',
+          f'total with output: {time.perf_counter() - start:.3f}s')
+
+if __name__ == "__main__":
+
+    # Connect to database, all questions share its connection pool.
+    engine = exercise_util.establish_connection()
+
+    # Run the queries and write to Excel output.
+    run_reports(engine)
+
+    # Disconnect from database.
+    exercise_util.disconnect_db(engine)
@@ -1,19 +1,26 @@
 #!/usr/bin/env python3
 import io
 import os
-import pkg_resources
-import exercise_util_qc as qc
+import json
+import re
+import glob
+import time
+import datetime
+import hashlib
+import tempfile
+import importlib.metadata
+import numpy as np
 import pandas as pd
-import plotly
 import sqlalchemy as alch
-import sqlalchemy_utils as alch_utils
-from PIL import Image
+import exercise_util_profile as prof
+from concurrent.futures import ThreadPoolExecutor
+
+# The QC stack (exercise_util_qc, pandera), sqlalchemy_utils, plotly and PIL
+# are imported in the functions that build the database or render charts, 
+# so reports over an existing database start without them.
 
 # Must use this version of kaleido to render the image in reasonable time.
-try:
-    pkg_resources.require("kaleido==0.1.*")
-except:
-    os.system("pip install kaleido==0.1.*")
+KALEIDO_VERSION = "0.1."
 
 # Parameters for MySQL connection.
 USER = "user"
@@ -22,10 +29,84 @@ HOST = "host"  # IP address can be used an alternative
 PORT = None  # Input port number if applicable
 DATABASE = "exercise_database"
 
+# Engine of the question queries when MySQL is not available. "sqlite" runs
+# them on the sample database, "duckdb" on a columnar copy of its tables in
+# DUCKDB_PATH, built by create_duckdb_db.
+BACKEND = "sqlite"
+DUCKDB_PATH = "exercise_database.duckdb"
+
+# Column types of the DuckDB copy by type in TABLES. Barcodes need 64 bits 
+# and sales stay floating point, as in SQLite.
+DUCKDB_TYPES = {
+    alch.types.String: "VARCHAR",
+    alch.types.Integer: "BIGINT",
+    alch.types.Numeric: "DOUBLE",
+    alch.types.DateTime: "TIMESTAMP",
+}
+
+# Directory of cached query results. None turns off the cache.
+PATH_CACHE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "cache")
+
+# Directory of the cleaned tables staged as Feather between QC and the load,
+# with a JSON sidecar of what they were cleaned from. None turns off staging.
+PATH_STAGING = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "staging")
+
+# Connection pool of the shared engines used by the question modules.
+POOL_SIZE = 5
+POOL_PRE_PING = True
+
+# Engines created by get_engine, in the form of engine_url: engine.
+ENGINES = {}
+
+# Rows fetched per round trip when reading query results.
+FETCH_CHUNKSIZE = 10000
+
+# Excel file of the results and the queued sheets for it, in the form of
+# sheet_name: DataFrame, written in one pass by flush_output.
+OUTPUT_XLSX = "exercise_results.xlsx"
+OUTPUT_QUEUE = {}
+
+# Data rows that fit in an Excel sheet, under the header row. Larger results
+# are also written in full as "parquet" or "csv".
+EXCEL_MAX_ROWS = 1048575
+SIDE_OUTPUT_FORMAT = "parquet"
+
+# Charts are rendered on one background thread, started on first use. 
+# HEADLESS (env EXERCISE_HEADLESS=1) saves charts without showing them.
+RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+RENDER_FUTURES = []
+HEADLESS = os.environ.get("EXERCISE_HEADLESS", "0") == "1"
+
 # Directory of where the soruce CSV are located.
 PATH_CSV = os.path.dirname(
     os.path.realpath(__file__)) + "\\source\\"
 
+# Number of processes for QC. With more than 1, tables and their columns 
+# are cleaned in parallel.
+QC_WORKERS = 1
+
+# Rows per chunk for a streaming load of the CSV files. None loads each 
+# file in one piece.
+CSV_CHUNKSIZE = None
+
+# Rows per INSERT batch in to_sql and the insert method. None uses the 
+# driver's executemany, "multi" uses multi-row INSERT statements.
+LOAD_CHUNKSIZE = 50000
+LOAD_METHOD = None
+
+# Bound parameter limit of SQLite (3.32+), caps "multi" batches.
+SQLITE_MAX_VARIABLES = 32766
+
+# SQLite pragmas for the one-shot load of the sample database.
+SQLITE_LOAD_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -262144,  # Negative is in KiB, so 256 MB
+    "temp_store": "MEMORY",
+}
+
 # Dictionary in the form of table_name: dtype_dict
 TABLES = {
     "PRODUCTS_TAKEHOME": {
@@ -57,15 +138,75 @@ TABLES = {
     }
 }
 
+# Join and filter columns indexed after the tables are loaded, in the form 
+# of table_name: list of index columns. The accession column of each table
+# from get_unique_req is indexed as well.
+INDEXES = {
+    "PRODUCTS_TAKEHOME": [
+        ["category_1"],
+        ["category_2"],
+    ],
+    "TRANSACTION_TAKEHOME": [
+        ["user_id"],
+        ["barcode"],
+    ],
+    "USER_TAKEHOME": [],
+}
+
+# Denormalized table of transactions joined with users and products. It is
+# built after loading and question modules read from it when it exists.
+FACT_TABLE = "FACT_TRANSACTIONS"
+USE_FACT_TABLE = True
+
+# Date functions that differ between dialects, in the form of 
+# dialect_name: {function_name: SQL template}. Templates are formatted with 
+# the column expressions by sql_function, e.g. years_between(end, start).
+SQL_FUNCTIONS = {
+    "sqlite": {
+        "year": "CAST(STRFTIME('%Y', {0}) AS int)",
+        # Whole years, less one while the anniversary is still ahead.
+        # Portable to SQLite before 3.43, which has no TIMEDIFF.
+        "years_between": "(CAST(STRFTIME('%Y', {0}) AS int)"
+                         " - CAST(STRFTIME('%Y', {1}) AS int)"
+                         " - (STRFTIME('%m-%d %H:%M:%f', {0})"
+                         " < STRFTIME('%m-%d %H:%M:%f', {1})))",
+        "days_between": "(JULIANDAY({0}) - JULIANDAY({1}))",
+    },
+    "mysql": {
+        "year": "YEAR({0})",
+        "years_between": "TIMESTAMPDIFF(YEAR, {1}, {0})",
+        "days_between": "(TIMESTAMPDIFF(SECOND, {1}, {0}) / 86400)",
+    },
+    "duckdb": {
+        "year": "YEAR({0})",
+        "years_between": "DATE_SUB('year', {1}, {0})",
+        "days_between": "((EPOCH_MS({0}) - EPOCH_MS({1})) / 86400000)",
+    },
+}
+
+# Table in the database recording fingerprints of the loaded source CSV.
+MANIFEST = alch.Table(
+    "LOAD_MANIFEST", alch.MetaData(),
+    alch.Column("table_name", alch.types.String(64), primary_key=True),
+    alch.Column("size", alch.types.BigInteger),
+    alch.Column("mtime", alch.types.Double),
+    alch.Column("sha256", alch.types.String(64)),
+    alch.Column("loaded_at", alch.types.DateTime),
+)
+
 '''
 Attempt to connect to MySQL server if available. Otherwise, check for
 exercise_database.db and create it from CSV files with SQLite engine
-to use for exercise purposes.
+to use for exercise purposes. With backend "duckdb" (default from BACKEND),
+the queries run on the DuckDB copy of the sample database instead.
 '''
-def establish_connection():
+def establish_connection(refresh=False, backend=None):
+    
+    if backend is None:
+        backend = BACKEND
 
     try:
-        engine = alch.create_engine(
+        engine = get_engine(
             "mysql://{0}:{1}@{2}:{3}/{4}/".format(
                 USER, PASSWORD, HOST, PORT, DATABASE),
         )
@@ -74,56 +215,841 @@ def establish_connection():
         engine_url = "sqlite:///exercise_database.db"
 
         # Create database using SQLite if there's no database.
-        if not alch_utils.database_exists(engine_url):
+        if not database_exists(engine_url):
             create_sample_db(engine_url)
-        engine = alch.create_engine(engine_url)
+        elif refresh:
+            refresh_sample_db(engine_url)
+        engine = get_engine(engine_url)
+        
+        if backend == "duckdb":
+            engine = get_duckdb_engine(engine_url)
 
     print("Connected to database... \n")
     return (engine)
 
-# Create the SQL database for exercise purposes.
-def create_sample_db(engine_url):
+'''
+Whether the database of a URL exists. SQLite files are checked on disk, so
+sqlalchemy_utils is only imported for server databases.
+'''
+def database_exists(engine_url):
+    url = alch.engine.make_url(engine_url)
+    if url.get_backend_name() == "sqlite":
+        return bool(url.database) and os.path.isfile(url.database) \
+            and os.path.getsize(url.database) > 0
+    
+    import sqlalchemy_utils as alch_utils
+    return alch_utils.database_exists(engine_url)
+
+'''
+Returns the shared engine for a URL, creating it on first use. Question
+modules run over the same connection pool instead of creating and 
+disposing their own engines.
+'''
+def get_engine(engine_url):
+    if engine_url not in ENGINES:
+        ENGINES[engine_url] = alch.create_engine(
+            engine_url,
+            pool_size=POOL_SIZE,
+            pool_pre_ping=POOL_PRE_PING,
+        )
+    return ENGINES[engine_url]
+
+'''
+Shared engine of the DuckDB copy of a sample database. The copy is built
+again when any table of the sample database was loaded since, by the
+manifest in both.
+'''
+def get_duckdb_engine(source_url):
+    engine_url = f"duckdb:///{DUCKDB_PATH}"
+    
+    source_engine = alch.create_engine(source_url)
+    manifest = read_manifest(source_engine)
+    source_engine.dispose()
+    
+    # Loaded copies of the manifest rows, as table_name: (sha256, loaded_at)
+    duckdb_manifest = {}
+    if os.path.exists(DUCKDB_PATH):
+        duckdb_manifest = read_manifest(get_engine(engine_url))
+    if (not manifest) or any(
+            (row["sha256"], row["loaded_at"]) != (
+                duckdb_manifest.get(table, {}).get("sha256"),
+                duckdb_manifest.get(table, {}).get("loaded_at"))
+            for table, row in manifest.items()):
+        create_duckdb_db(engine_url, source_url)
+    
+    return get_engine(engine_url)
+
+'''
+Copy the tables of the sample database into DuckDB, which runs the large 
+group-by aggregations of the questions column by column. Tables are read
+from the staging area when staged from the CSV they were loaded from, 
+otherwise from the sample database. The manifest is copied with them, and
+the fact table is built with the DuckDB date functions. It is not a 
+profiled run of its own, so the report of the load it follows is kept.
+'''
+def create_duckdb_db(engine_url, source_url):
+    
+    print("Creating DuckDB copy of the sample database...")
+    source_engine = alch.create_engine(source_url)
+    manifest = read_manifest(source_engine)
+    engine = alch.create_engine(engine_url)
+    
+    with engine.begin() as conn, source_engine.connect() as source_conn:
+        for table in TABLES.keys():
+            loaded = manifest.get(table)
+            if (loaded is not None) and (
+                    read_staging_info(table, loaded) is not None):
+                df = read_staging(table)
+            else:
+                df = read_query(source_conn, 
+                                alch.text(f"SELECT * FROM {table}"))
+            
+            c_rows, secs = load_duckdb_table(df, table, conn)
+            if loaded is not None:
+                write_manifest(conn, table, loaded, loaded["loaded_at"])
+            print(f"\tCopied table: {table} ({c_rows} rows in {secs:.2f}s)")
+    
+    build_fact_table(engine)
+    source_engine.dispose()
+    engine.dispose()
+
+'''
+Create a table in DuckDB from a DataFrame, which DuckDB scans in place.
+Columns are cast to DUCKDB_TYPES, and time zones dropped as UTC, the same 
+values SQLite holds. Returns the number of rows and seconds taken.
+'''
+def load_duckdb_table(df, table, conn):
+    
+    start = time.perf_counter()
+    with prof.stage("to_duckdb", table, rows_in=df.shape[0]) as record:
+        for col_name in df.columns:
+            if isinstance(df[col_name].dtype, pd.DatetimeTZDtype):
+                df[col_name] = df[col_name].dt.tz_convert(None)
+        
+        columns = ", ".join(
+            f"CAST({col_name} AS {DUCKDB_TYPES[col_type]}) AS {col_name}"
+            for col_name, col_type in TABLES[table].items())
+        
+        driver_conn = conn.connection.driver_connection
+        driver_conn.register("df_load", df)
+        try:
+            conn.execute(alch.text(f"CREATE OR REPLACE TABLE {table} AS "
+                                   f"SELECT {columns} FROM df_load"))
+        finally:
+            driver_conn.unregister("df_load")
+        record["rows_out"] = df.shape[0]
+    return df.shape[0], time.perf_counter() - start
+
+'''
+Execute a query and return the result as a DataFrame. Results are cached
+on disk as Parquet, keyed on the dialect, the normalized SQL text and the
+manifest entries (hash and load time) of the tables the query reads. A 
+reload or refresh of any of those tables changes the key, so stale results
+are not used. Without a manifest, e.g. on MySQL, queries always run. A 
+result is written to a temporary file and moved into place once complete,
+so an interrupted run or a concurrent reader never sees a partial file.
+'''
+def cached_query(conn, sql_query):
+    
+    sql_text = " ".join(str(sql_query).split())
+    cache_key = get_cache_key(conn, sql_text)
+    if cache_key is None:
+        return read_query(conn, sql_query)
+    
+    path_parquet = os.path.join(PATH_CACHE, cache_key + ".parquet")
+    if os.path.exists(path_parquet):
+        return pd.read_parquet(path_parquet)
+    
+    df = read_query(conn, sql_query)
+    os.makedirs(PATH_CACHE, exist_ok=True)
+    fd, path_tmp = tempfile.mkstemp(suffix=".tmp", dir=PATH_CACHE)
+    os.close(fd)
+    try:
+        df.to_parquet(path_tmp, index=False)
+        os.replace(path_tmp, path_parquet)
+    except ImportError as e:
+        print(f"Query result not cached: {e}")
+    finally:
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+    return df
+
+'''
+Execute a query and build a DataFrame from the result chunksize rows at a 
+time. Results are streamed from a server-side cursor where the driver has 
+one, so the full result is never held as a list of rows. Each chunk is cast
+to dtypes (column: dtype) and, with dtype_backend, e.g. "pyarrow", to 
+Arrow-backed columns. With a writer, each chunk is passed to writer(df) 
+instead of being kept, and None is returned.
+'''
+def read_query(conn, sql_query, dtypes=None, chunksize=FETCH_CHUNKSIZE, 
+               writer=None, dtype_backend=None):
+    
+    # Options for this statement only, the shared connection keeps its own
+    result = conn.execute(sql_query, execution_options={
+        "stream_results": True, "yield_per": chunksize})
+    columns = list(result.keys())
+    
+    arr_df = []
+    for partition in result.partitions(chunksize):
+        df_chunk = type_query_chunk(
+            pd.DataFrame.from_records(partition, columns=columns), 
+            dtypes, dtype_backend)
+        if writer is None:
+            arr_df.append(df_chunk)
+        else:
+            writer(df_chunk)
+    
+    if writer is not None:
+        return None
+    if not arr_df:
+        return type_query_chunk(
+            pd.DataFrame(columns=columns), dtypes, dtype_backend)
+    return pd.concat(arr_df, ignore_index=True)
+
+# Cast a chunk of query results for read_query.
+def type_query_chunk(df, dtypes=None, dtype_backend=None):
+    dtypes = {k: v for k, v in (dtypes or {}).items() if k in df.columns}
+    if dtypes:
+        df = df.astype(dtypes)
+    
+    # Columns without an explicit dtype are inferred by the backend
+    cols_infer = [col for col in df.columns if col not in dtypes]
+    if dtype_backend is not None and cols_infer:
+        df[cols_infer] = df[cols_infer].convert_dtypes(
+            dtype_backend=dtype_backend)
+    return df
+
+# Returns the cache key of a normalized query, None if it can't be cached.
+def get_cache_key(conn, sql_text):
+    
+    if PATH_CACHE is None:
+        return None
+    
+    tables = [table for table in TABLES.keys() 
+              if re.search(rf"\b{table}\b", sql_text, re.IGNORECASE)]
+    
+    # The fact table is built from all tables
+    if re.search(rf"\b{FACT_TABLE}\b", sql_text, re.IGNORECASE):
+        tables = list(TABLES.keys())
+    
+    # Results of no tracked table could never be invalidated
+    if not tables:
+        return None
+    if not alch.inspect(conn).has_table(MANIFEST.name):
+        return None
+    
+    rows = conn.execute(
+        MANIFEST.select()
+        .where(MANIFEST.c.table_name.in_(tables))
+        .order_by(MANIFEST.c.table_name)
+    ).mappings().all()
+    if len(rows) != len(tables):
+        return None
+    
+    # Same SQL text gives the same result on the same dialect only
+    fingerprint = [conn.dialect.name, sql_text] + [
+        f"{row['table_name']}:{row['sha256']}:{row['loaded_at']}" 
+        for row in rows]
+    return hashlib.sha256("\n".join(fingerprint).encode()).hexdigest()
+
+# Remove all cached query results.
+def clear_cache():
+    if (PATH_CACHE is not None) and os.path.isdir(PATH_CACHE):
+        for path in glob.glob(os.path.join(PATH_CACHE, "*.parquet")):
+            os.remove(path)
+
+# Read the source CSV of a table with the column names from TABLES. With
+# a chunksize, returns an iterator of DataFrames instead. With an offset,
+# only rows after that byte position are read (e.g. appended rows). dtype
+# is passed to read_csv, e.g. categoricals for the 'lean' QC mode.
+def read_source_csv(table, chunksize=None, offset=0, dtype=None):
+    
+    source_csv = PATH_CSV + table + ".csv"
+    col_names = list(TABLES.get(table).keys())
+    
+    if offset:
+        with open(source_csv, "rb") as f:
+            f.seek(offset)
+            try:
+                df = pd.read_csv(f, header=None, names=col_names,
+                                 keep_default_na=True, dtype=dtype)
+            except pd.errors.EmptyDataError:
+                df = pd.DataFrame(columns=col_names)
+        return df
+    
+    df = pd.read_csv(
+        source_csv, 
+        header=0, 
+        names=col_names,
+        keep_default_na=True,
+        chunksize=chunksize,
+        dtype=dtype,
+    )
+    return df
+
+# Read and QC a table. Kept at module level to run in a process pool.
+def qc_source_csv(table, workers=1):
+    import exercise_util_qc as qc
+    
+    position = prof.mark()
+    fallbacks_before = qc.DATETIME_FALLBACKS.copy()
+    with prof.stage("read_csv", table) as record:
+        df = read_source_csv(table, dtype=qc.get_read_dtypes(table))
+        record["rows_out"] = df.shape[0]
+    df = qc.qc_controller(df, table, workers)
+    
+    # Stage records and dateutil counts go back with the table, also from a
+    # process pool
+    df.attrs["profile"] = prof.take_since(position)
+    df.attrs["datetime_fallbacks"] = qc.take_fallbacks_since(fallbacks_before)
+    return df
+
+'''
+Create the SQL database for exercise purposes. Cleaned tables are staged
+under PATH_STAGING and loaded from there while the CSV and QC are the same.
+If any step fails, the half-built database is dropped, so a later run
+creates it again instead of taking it for a finished one.
+'''
+@prof.profiled_run
+def create_sample_db(engine_url, workers=None, chunksize=None):
+    import sqlalchemy_utils as alch_utils
+
+    if workers is None:
+        workers = QC_WORKERS
+    if chunksize is None:
+        chunksize = CSV_CHUNKSIZE
 
     print("Creating sample database...")
     alch_utils.create_database(engine_url)
-    engine = alch.create_engine(engine_url)
+    engine = create_load_engine(engine_url)
+    
+    try:
+        # Streaming load keeps only one chunk of each table in memory, so
+        # the cleaned tables are not staged.
+        if chunksize:
+            for table in TABLES.keys():
+                fingerprint = fingerprint_csv(table)
+                load_source_chunks(engine, table, chunksize, workers)
+                with engine.begin() as conn:
+                    write_manifest(conn, table, fingerprint)
+        else:
+            load_source_tables(engine, workers)
+        
+        create_indexes(engine)
+        build_fact_table(engine)
+    except BaseException:
+        engine.dispose()
+        alch_utils.drop_database(engine_url)
+        print("Failed to create sample database, removed it...")
+        raise
+    
+    clear_cache()
+    engine.dispose()
 
-    # Load CSV tables.
-    for table in TABLES.keys():
+# Load every table whole, from the staging area or by cleaning its CSV.
+def load_source_tables(engine, workers=1):
+    import exercise_util_qc as qc
 
-        source_csv = PATH_CSV + table + ".csv"
-        col_names = list(TABLES.get(table).keys())
+    # Tables staged from the same CSV and QC skip reading and cleaning
+    fingerprints = {table: fingerprint_csv(table) for table in TABLES.keys()}
+    tables_qc = [table for table in TABLES.keys() 
+                 if read_staging_info(table, fingerprints[table]) is None]
 
-        df = pd.read_csv(
-            source_csv, 
-            header=0, 
-            names=col_names,
-            keep_default_na=True 
+    # Tables are independent until loaded, so QC runs for all tables at 
+    # once and the columns of each table share the remaining workers.
+    executor = None
+    if (workers > 1) and tables_qc:
+        executor = qc.create_executor(min(workers, len(tables_qc)))
+        col_workers = max(workers // len(tables_qc), 1)
+        futures = {table: executor.submit(qc_source_csv, table, col_workers)
+                   for table in tables_qc}
+    
+    # Load CSV tables. Writes to the database stay serial.
+    try:
+        for table in TABLES.keys():
+            
+            fingerprint = fingerprints[table]
+            if table not in tables_qc:
+                df_qc = read_staging(table)
+            else:
+                if executor is not None:
+                    df_qc = futures[table].result()
+                else:
+                    df_qc = qc_source_csv(table)
+                prof.merge(df_qc.attrs.pop("profile", None))
+                qc.merge_fallbacks(df_qc.attrs.pop("datetime_fallbacks", None))
+                write_staging(df_qc, table, fingerprint)
+            
+            with engine.begin() as conn:
+                c_rows, secs = load_table(df_qc, table, conn)
+                write_manifest(conn, table, fingerprint)
+            print(f"\tLoaded table: {table} ({c_rows} rows in {secs:.2f}s,",
+                  f"{c_rows / max(secs, 1e-9):,.0f} rows/s)")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+'''
+Load a table from its CSV in chunks. Columns are cleaned per chunk and 
+appended to the table, then duplicates across all chunks are reconciled
+in one keyed pass over the loaded table.
+'''
+def load_source_chunks(engine, table, chunksize, workers=1):
+    import exercise_util_qc as qc
+    
+    # Process pool for column cleaning, shared by all chunks
+    executor = None
+    if workers > 1:
+        executor = qc.create_executor(workers)
+    
+    c_rows, secs = 0, 0.0
+    try:
+        chunks = read_source_csv(table, chunksize, 
+                                 dtype=qc.get_read_dtypes(table))
+        for i, df_chunk in enumerate(chunks):
+            df_qc = qc.qc_table(df_chunk, table, executor)
+            with engine.begin() as conn:
+                c_chunk, secs_chunk = load_table(
+                    df_qc, table, conn, 
+                    if_exists="replace" if i == 0 else "append")
+            c_rows += c_chunk
+            secs += secs_chunk
+            print(f"\t\t... Appended {c_rows} rows to {table}")
+        
+        reconcile_loaded(engine, table, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    print(f"\tLoaded table: {table} ({c_rows} rows in {secs:.2f}s,",
+          f"{c_rows / max(secs, 1e-9):,.0f} rows/s)")
+
+'''
+Keyed duplicate pass on a loaded table. Only rows whose accession is 
+duplicated on the unique requirements are read back, reconciled with
+qc_by_row and swapped in, so memory depends on the duplicates only.
+'''
+def reconcile_loaded(engine, table, executor=None):
+    import exercise_util_qc as qc
+    
+    accession, unique_req = qc.get_unique_req(table)
+    
+    # Derived table so MySQL allows it in DELETE on the same table
+    sql_dup_acc = (
+        f"SELECT {accession} FROM ("
+        f"SELECT {accession} FROM {table} "
+        f"WHERE {accession} IS NOT NULL "
+        f"GROUP BY {', '.join(unique_req)} "
+        f"HAVING COUNT(*) > 1) AS dup_acc"
+    )
+    
+    with engine.begin() as conn, \
+            prof.stage("reconcile_loaded", table) as record:
+        df_dups = pd.read_sql(
+            alch.text(f"SELECT * FROM {table} "
+                      f"WHERE {accession} IN ({sql_dup_acc})"),
+            conn,
         )
-        df_qc = qc.qc_controller(df, table)
+        record["rows_in"] = df_dups.shape[0]
+        if df_dups.empty:
+            print(f'\tNo duplications found in {table}!')
+            return
         
-        df_qc.to_sql(
+        # NULL is read back as None, which clean_string would keep as text
+        df_dups = df_dups.fillna(value=np.nan)
+        df_dups = qc.qc_table(df_dups, table, executor)
+        df_reconciled = qc.qc_by_row(df_dups, table)
+        df_reconciled = qc.qc_table(df_reconciled, table, executor)
+        
+        conn.execute(alch.text(f"DELETE FROM {table} "
+                               f"WHERE {accession} IN ({sql_dup_acc})"))
+        load_table(df_reconciled, table, conn, if_exists="append")
+        record["rows_out"] = df_reconciled.shape[0]
+
+'''
+Refresh an existing database from the source CSV. Tables whose CSV did 
+not change are skipped. When rows were only appended to a CSV, just those
+rows are cleaned and added, then merged by accession with the keyed 
+duplicate pass. Any other change reloads that table in full. The database
+is updated in place, so it is written through the shared engine without
+the SQLITE_LOAD_PRAGMAS of a new build. Indexes, the fact table and the
+query cache are only rebuilt when a table was appended to or reloaded.
+'''
+@prof.profiled_run
+def refresh_sample_db(engine_url, workers=None):
+    import exercise_util_qc as qc
+    
+    if workers is None:
+        workers = QC_WORKERS
+    
+    print("Refreshing sample database...")
+    engine = get_engine(engine_url)
+    manifest = read_manifest(engine)
+    
+    changed = False
+    for table in TABLES.keys():
+        loaded = manifest.get(table)
+        source_csv = PATH_CSV + table + ".csv"
+        
+        # Same size and modification time, no need to hash the file
+        if (loaded is not None) and (
+                os.path.getsize(source_csv) == loaded["size"]) and (
+                os.path.getmtime(source_csv) == loaded["mtime"]):
+            print(f"\tUnchanged table: {table}")
+            continue
+        
+        prefix_size = loaded["size"] if loaded is not None else None
+        fingerprint = fingerprint_csv(table, prefix_size)
+        
+        # Same content, only the modification time is updated. The load 
+        # time stays, so cached results of the table are still used.
+        if (loaded is not None) and (fingerprint["sha256"] == loaded["sha256"]):
+            print(f"\tUnchanged table: {table}")
+            with engine.begin() as conn:
+                write_manifest(conn, table, fingerprint, loaded["loaded_at"])
+            continue
+            
+        elif (loaded is not None) and (
+                fingerprint["prefix_sha256"] == loaded["sha256"]):
+            # Only new rows at the end of the CSV
+            df_new = read_source_csv(table, offset=loaded["size"], 
+                                     dtype=qc.get_read_dtypes(table))
+            df_new = qc.qc_table(df_new, table)
+            with engine.begin() as conn:
+                c_rows, secs = load_table(df_new, table, conn, 
+                                          if_exists="append")
+            reconcile_loaded(engine, table)
+            print(f"\tAppended {c_rows} rows to table: {table}")
+            
+        elif read_staging_info(table, fingerprint) is not None:
+            df_qc = read_staging(table)
+            with engine.begin() as conn:
+                c_rows, secs = load_table(df_qc, table, conn)
+            print(f"\tReloaded table from staging: {table} ({c_rows} rows)")
+            
+        else:
+            df_qc = qc_source_csv(table, workers)
+            prof.merge(df_qc.attrs.pop("profile", None))
+            qc.merge_fallbacks(df_qc.attrs.pop("datetime_fallbacks", None))
+            write_staging(df_qc, table, fingerprint)
+            with engine.begin() as conn:
+                c_rows, secs = load_table(df_qc, table, conn)
+            print(f"\tReloaded table: {table} ({c_rows} rows)")
+        
+        with engine.begin() as conn:
+            write_manifest(conn, table, fingerprint)
+        changed = True
+    
+    if not changed:
+        return
+    
+    # Cached results of the changed tables no longer match the manifest
+    create_indexes(engine)
+    build_fact_table(engine)
+
+'''
+Fingerprint of a source CSV with its size, modification time and SHA-256.
+With prefix_size, the hash of only the first prefix_size bytes is also
+returned to tell whether rows were appended to a previously loaded file.
+'''
+def fingerprint_csv(table, prefix_size=None):
+    source_csv = PATH_CSV + table + ".csv"
+    
+    fingerprint = {
+        "size": os.path.getsize(source_csv),
+        "mtime": os.path.getmtime(source_csv),
+        "prefix_sha256": None,
+    }
+    
+    sha256 = hashlib.sha256()
+    c_bytes = 0
+    with open(source_csv, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            if (prefix_size is not None) and (
+                    c_bytes < prefix_size <= c_bytes + len(block)):
+                sha256_prefix = sha256.copy()
+                sha256_prefix.update(block[:prefix_size - c_bytes])
+                fingerprint["prefix_sha256"] = sha256_prefix.hexdigest()
+            sha256.update(block)
+            c_bytes += len(block)
+    
+    fingerprint["sha256"] = sha256.hexdigest()
+    return fingerprint
+
+# Hash of what decides the cleaned values besides the CSV: the QC module, 
+# its dtype mode and the column types in TABLES.
+def get_qc_key():
+    import exercise_util_qc as qc
+    
+    sha256 = hashlib.sha256()
+    with open(qc.__file__, "rb") as f:
+        sha256.update(f.read())
+    sha256.update(f"{qc.DTYPE_MODE}\n{TABLES!r}".encode())
+    return sha256.hexdigest()
+
+'''
+Returns the sidecar of a staged table, None if it is not staged or, with a
+fingerprint, was not staged from that CSV with the current QC.
+'''
+def read_staging_info(table, fingerprint=None):
+    if PATH_STAGING is None:
+        return None
+    
+    path_json = os.path.join(PATH_STAGING, table + ".json")
+    if not os.path.exists(path_json):
+        return None
+    with open(path_json) as f:
+        info = json.load(f)
+    
+    if (fingerprint is not None) and (
+            (info["sha256"] != fingerprint["sha256"]) 
+            or (info["qc_key"] != get_qc_key())):
+        return None
+    return info
+
+'''
+Read a staged table. The Feather file is memory-mapped, so its columns
+come straight from the page cache. Also for analysis in pandas without
+the database, e.g. read_staging("USER_TAKEHOME").
+'''
+def read_staging(table):
+    from pyarrow import feather
+    
+    path_feather = os.path.join(PATH_STAGING, table + ".feather")
+    with prof.stage("read_staging", table) as record:
+        df = feather.read_table(path_feather, memory_map=True).to_pandas()
+        record["rows_out"] = df.shape[0]
+    print(f"\tRead staged table: {table} ({df.shape[0]} rows)")
+    return df
+
+'''
+Stage a cleaned table as uncompressed Feather with a JSON sidecar of the 
+CSV fingerprint and QC key. The sidecar is written last, so a table is 
+never read from a partly written file.
+'''
+def write_staging(df, table, fingerprint):
+    if PATH_STAGING is None:
+        return
+    try:
+        import pyarrow as pa
+        from pyarrow import feather
+    except ImportError as e:
+        print(f"Table not staged: {e}")
+        return
+    
+    os.makedirs(PATH_STAGING, exist_ok=True)
+    path_json = os.path.join(PATH_STAGING, table + ".json")
+    path_feather = os.path.join(PATH_STAGING, table + ".feather")
+    if os.path.exists(path_json):
+        os.remove(path_json)
+    
+    with prof.stage("write_staging", table, rows_in=df.shape[0]):
+        feather.write_feather(pa.Table.from_pandas(df, preserve_index=False),
+                              path_feather, compression="uncompressed")
+    with open(path_json, "w") as f:
+        json.dump({
+            "table": table,
+            "rows": df.shape[0],
+            "sha256": fingerprint["sha256"],
+            "qc_key": get_qc_key(),
+            "staged_at": datetime.datetime.now().isoformat(),
+        }, f, indent=2)
+
+# Returns the manifest as table_name: row dictionary, empty if not created.
+def read_manifest(engine):
+    with engine.connect() as conn:
+        if not alch.inspect(conn).has_table(MANIFEST.name):
+            return {}
+        rows = conn.execute(MANIFEST.select()).mappings().all()
+    return {row["table_name"]: dict(row) for row in rows}
+
+# Record the fingerprint of the source CSV a table was loaded from. 
+# loaded_at is given when copying the manifest of another database.
+def write_manifest(conn, table, fingerprint, loaded_at=None):
+    MANIFEST.create(bind=conn, checkfirst=True)
+    conn.execute(MANIFEST.delete().where(MANIFEST.c.table_name == table))
+    conn.execute(MANIFEST.insert().values(
+        table_name=table,
+        size=fingerprint["size"],
+        mtime=fingerprint["mtime"],
+        sha256=fingerprint["sha256"],
+        loaded_at=loaded_at or datetime.datetime.now(),
+    ))
+
+# Engine for building the database. SQLite connections get the pragmas in
+# SQLITE_LOAD_PRAGMAS, which trade crash safety for load speed.
+def create_load_engine(engine_url):
+    engine = alch.create_engine(engine_url)
+    
+    if engine.dialect.name == "sqlite":
+        @alch.event.listens_for(engine, "connect")
+        def set_load_pragmas(dbapi_conn, conn_record):
+            cursor = dbapi_conn.cursor()
+            for pragma, value in SQLITE_LOAD_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {pragma} = {value}")
+            cursor.close()
+    
+    return engine
+
+'''
+Bulk insert a DataFrame into a table on an open connection, so the whole
+load is one transaction. Returns the number of rows and seconds taken.
+'''
+def load_table(df, table, conn, if_exists="replace"):
+    
+    chunksize = LOAD_CHUNKSIZE
+    if (LOAD_METHOD == "multi") and (conn.dialect.name == "sqlite"):
+        # Multi-row INSERT is limited by the number of bound parameters
+        chunksize = min(chunksize, SQLITE_MAX_VARIABLES // df.shape[1])
+    
+    start = time.perf_counter()
+    with prof.stage("to_sql", table, rows_in=df.shape[0]) as record:
+        df.to_sql(
             name=table,
-            con=engine,
-            if_exists="replace",
+            con=conn,
+            if_exists=if_exists,
             index=False,
             dtype=TABLES.get(table),
+            chunksize=chunksize,
+            method=LOAD_METHOD,
         )
-        print("\tLoaded table: " + table)
-    engine.dispose()
+        record["rows_out"] = df.shape[0]
+    return df.shape[0], time.perf_counter() - start
 
-    return
+'''
+Build the fact table from the loaded tables. Each transaction is joined
+once with its user and product, with the birth year, generation, age at
+scan and account age at scan computed once per row. Users and products
+are assumed unique per id and barcode after QC, as the joins in the
+question queries do.
+
+Generational defintion taken from: https://libguides.usc.edu/busdem/ag
+'''
+def build_fact_table(engine):
+    
+    with engine.begin() as conn, prof.stage("build_fact_table", FACT_TABLE):
+        conn.execute(alch.text(f"DROP TABLE IF EXISTS {FACT_TABLE}"))
+        conn.execute(alch.text(get_fact_sql(conn)))
+    print(f"\tBuilt fact table: {FACT_TABLE}")
+
+# Returns the CREATE TABLE statement of the fact table in the dialect of conn.
+def get_fact_sql(conn):
+    
+    age_at_scan = sql_function(conn, "years_between", 
+                               "t.scan_date", "u.birth_date")
+    account_age_days = sql_function(conn, "days_between", 
+                                    "t.scan_date", "u.created_date")
+    birth_year = sql_function(conn, "year", "birth_date")
+    
+    return f"""
+        CREATE TABLE {FACT_TABLE} AS
+        SELECT t.receipt_id,
+            t.purchase_date,
+            t.scan_date,
+            t.store_name,
+            t.user_id,
+            t.barcode,
+            t.final_quantity,
+            t.final_sale,
+            u.id AS user_table_id,
+            u.created_date,
+            u.birth_date,
+            u.state,
+            u.language,
+            u.gender,
+            u.birth_year,
+            CASE
+                WHEN u.birth_year BETWEEN 1900 AND 1924 THEN 'The Greatest Generation'
+                WHEN u.birth_year BETWEEN 1925 AND 1945 THEN 'The Silent Generation'
+                WHEN u.birth_year BETWEEN 1946 AND 1964 THEN 'Baby Boomers'
+                WHEN u.birth_year BETWEEN 1965 AND 1979 THEN 'Generation X'
+                WHEN u.birth_year BETWEEN 1980 AND 1994 THEN 'Millennials'
+                WHEN u.birth_year BETWEEN 1995 AND 2012 THEN 'Generation Z'
+                WHEN u.birth_year BETWEEN 2013 AND 2025 THEN 'Gen Alpha'
+            END AS generation,
+            CASE
+                WHEN u.birth_year BETWEEN 1900 AND 1924 THEN 0
+                WHEN u.birth_year BETWEEN 1925 AND 1945 THEN 1
+                WHEN u.birth_year BETWEEN 1946 AND 1964 THEN 2
+                WHEN u.birth_year BETWEEN 1965 AND 1979 THEN 3
+                WHEN u.birth_year BETWEEN 1980 AND 1994 THEN 4
+                WHEN u.birth_year BETWEEN 1995 AND 2012 THEN 5
+                WHEN u.birth_year BETWEEN 2013 AND 2025 THEN 6
+            END AS generation_order,
+            {age_at_scan} AS age_at_scan,
+            {account_age_days} AS account_age_days,
+            p.category_1,
+            p.category_2,
+            p.category_3,
+            p.category_4,
+            p.manufacturer,
+            p.brand
+        FROM TRANSACTION_TAKEHOME t
+            LEFT JOIN (
+                SELECT *,
+                    {birth_year} AS birth_year
+                FROM USER_TAKEHOME
+            ) u ON t.user_id = u.id
+            LEFT JOIN PRODUCTS_TAKEHOME p ON t.barcode = p.barcode
+    """
 
-# Disconnect and, if needed, remove sample database for cleanliness.
+# Returns the SQL of a function in SQL_FUNCTIONS for the dialect of conn.
+def sql_function(conn, name, *args):
+    return SQL_FUNCTIONS[conn.dialect.name][name].format(*args)
+
+# Whether question modules should read from the fact table.
+def use_fact_table(conn):
+    return USE_FACT_TABLE and alch.inspect(conn).has_table(FACT_TABLE)
+
+# Returns sqlalchemy Index objects for a table from INDEXES and its accession.
+def get_indexes(table, conn):
+    import exercise_util_qc as qc
+    
+    accession, unique_req = qc.get_unique_req(table)
+    tbl = alch.Table(table, alch.MetaData(), autoload_with=conn)
+    
+    arr_indexes = []
+    for cols in [[accession]] + INDEXES.get(table, []):
+        index_name = f"ix_{table}_{'_'.join(cols)}".lower()
+        arr_indexes.append(alch.Index(index_name, *[tbl.c[c] for c in cols]))
+    return arr_indexes
+
+# Create indexes of all tables, skipping ones that already exist.
+def create_indexes(engine):
+    with engine.begin() as conn, prof.stage("create_indexes"):
+        for table in TABLES.keys():
+            for index in get_indexes(table, conn):
+                index.create(bind=conn, checkfirst=True)
+    print("\tCreated indexes...")
+
+# Drop indexes of all tables, e.g. to compare query timings.
+def drop_indexes(engine):
+    with engine.begin() as conn:
+        for table in TABLES.keys():
+            for index in get_indexes(table, conn):
+                index.drop(bind=conn, checkfirst=True)
+
+# Disconnect and, if needed, remove sample database for cleanliness. Its
+# DuckDB copy goes with it, since the copy is only rebuilt from it.
 def disconnect_db(engine):
     
     engine.dispose()
-    if os.path.exists("exercise_database.db"):
+    for engine_url in [k for k, v in ENGINES.items() if v is engine]:
+        del ENGINES[engine_url]
+    paths_db = [path for path in ["exercise_database.db", DUCKDB_PATH, 
+                                  DUCKDB_PATH + ".wal"] 
+                if os.path.exists(path)]
+    if paths_db:
         try:
             while True:
                 input_delet_db = input('Delete sample database?...[Y/N]:  ')
                 if input_delet_db.lower() == 'y':
-                    os.remove("exercise_database.db")
+                    duckdb_engine = ENGINES.pop(f"duckdb:///{DUCKDB_PATH}", 
+                                                None)
+                    if duckdb_engine is not None:
+                        duckdb_engine.dispose()
+                    for path in paths_db:
+                        os.remove(path)
                     print("Sample database deleted... ")
                     break
                 if input_delet_db.lower() == 'n':
@@ -133,42 +1059,115 @@ def disconnect_db(engine):
 
 # Write results to sheets in an Excel file and print chart, if applicable.
 def write_output(df, sheet_name, fig=None):
+    queue_output(df, sheet_name, fig)
+    flush_output()
+
+'''
+Add results to the sheets written by the next flush_output, and start
+rendering the chart in the background, if applicable. A sheet queued twice
+keeps the last one.
+'''
+def queue_output(df, sheet_name, fig=None):
+    OUTPUT_QUEUE[sheet_name.lower()] = df
+    
+    if fig != None:
+        write_figure(fig, sheet_name)
+
+'''
+Write all queued sheets to the Excel file in one pass. A new file is 
+written with xlsxwriter. In an existing file, openpyxl replaces the queued
+sheets and leaves the others as they are, so earlier results are kept
+without reading them back into pandas. Returns after the queued charts are
+saved, also when no sheet is queued. Results over EXCEL_MAX_ROWS are also
+written in full to a SIDE_OUTPUT_FORMAT file next to the workbook, as the 
+sheet can only hold the first rows.
+'''
+def flush_output():
+    if not OUTPUT_QUEUE:
+        wait_for_figures()
+        return
+    
     output_dir = os.path.dirname(os.path.realpath(__file__))
-    output_path_xlsx = output_dir + '\\exercise_results.xlsx'
-    output_path_img = output_dir + f'\\img_{sheet_name.lower()}.png'
+    output_path_xlsx = os.path.join(output_dir, OUTPUT_XLSX)
     
-    if not os.path.exists(output_path_xlsx):
-        writer = pd.ExcelWriter(
-            path=output_path_xlsx,
-            engine='xlsxwriter'
-        )
+    writer_args = {"engine": "xlsxwriter"}
+    if os.path.exists(output_path_xlsx):
+        writer_args = {"engine": "openpyxl", "mode": "a", 
+                       "if_sheet_exists": "replace"}
+    
+    with pd.ExcelWriter(path=output_path_xlsx, **writer_args) as writer:
+        for sheet_name, df in OUTPUT_QUEUE.items():
+            if df.shape[0] > EXCEL_MAX_ROWS:
+                write_side_output(df, sheet_name, output_dir)
+            df.head(EXCEL_MAX_ROWS).to_excel(excel_writer=writer, 
+                                             sheet_name=sheet_name, 
+                                             index=False)
+    
+    print(f"Results written to {OUTPUT_XLSX}: {', '.join(OUTPUT_QUEUE)}")
+    OUTPUT_QUEUE.clear()
+    
+    wait_for_figures()
+
+# Write the full results of a sheet too large for Excel.
+def write_side_output(df, sheet_name, output_dir):
+    output_name = os.path.splitext(OUTPUT_XLSX)[0]
+    output_path = os.path.join(
+        output_dir, f'{output_name}_{sheet_name}.{SIDE_OUTPUT_FORMAT}')
+    
+    if SIDE_OUTPUT_FORMAT == 'parquet':
+        df.to_parquet(output_path, index=False)
     else:
-        writer = pd.ExcelWriter(
-            engine='openpyxl',
-            mode='a',
-            if_sheet_exists='replace',
-            path=output_path_xlsx
-        )
+        df.to_csv(output_path, index=False)
+    print(f"\t{sheet_name} has {df.shape[0]} rows, Excel sheet holds the",
+          f"first {EXCEL_MAX_ROWS}, all rows written to {output_path}")
 
-        
-    df.to_excel(excel_writer=writer, 
-                sheet_name=sheet_name.lower(), 
-                index=False
-    )
-    writer.close()
+'''
+Render the chart of a sheet in the background and return its future. Charts
+are rendered one at a time on a single thread, so the kaleido process stays
+up between figures, and each figure is rendered once: the PNG bytes are 
+saved and reused for the preview, which is skipped when HEADLESS.
+'''
+def write_figure(fig, sheet_name):
+    output_dir = os.path.dirname(os.path.realpath(__file__))
+    output_path_img = os.path.join(output_dir, f'img_{sheet_name.lower()}.png')
     
-    if fig != None:
-        print("Generating figure...")
-        
-        # Show and save the figure locally.
-        img = plotly.io.to_image(fig=fig,
-                                 engine='kaleido',)
-        
+    future = RENDER_EXECUTOR.submit(
+        render_figure, fig, sheet_name, output_path_img)
+    RENDER_FUTURES.append(future)
+    return future
+
+# Render a chart to PNG once, save it and show it unless HEADLESS.
+def render_figure(fig, sheet_name, output_path_img):
+    import plotly.io
+    from PIL import Image
+    
+    ensure_kaleido()
+    print(f"Generating figure of {sheet_name}...")
+    
+    img = plotly.io.to_image(fig=fig, format='png', engine='kaleido')
+    with open(output_path_img, 'wb') as f:
+        f.write(img)
+    
+    if not HEADLESS:
         Image.open(io.BytesIO(img)).show()
 
-        plotly.io.write_image(fig=fig,
-                              file = output_path_img,
-                              format='png',
-                              engine='kaleido')
+    print(f"Figure of {sheet_name} was saved!")
+
+'''
+Check kaleido before the first chart is rendered. Other versions than 
+KALEIDO_VERSION render, only slower, so they are reported, not installed.
+'''
+def ensure_kaleido():
+    try:
+        version = importlib.metadata.version("kaleido")
+    except importlib.metadata.PackageNotFoundError:
+        raise ImportError(
+            f"kaleido is needed to render charts: "
+            f"pip install kaleido=={KALEIDO_VERSION}*")
+    if not version.startswith(KALEIDO_VERSION):
+        print(f"kaleido {version} found, {KALEIDO_VERSION}* renders faster")
 
-        print(f"Figure of {sheet_name} was saved!")
\ No newline at end of file
+# Wait for the charts queued by write_figure, raising any render error.
+def wait_for_figures():
+    while RENDER_FUTURES:
+        RENDER_FUTURES.pop(0).result()
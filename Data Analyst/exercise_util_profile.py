@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import datetime
+import functools
+import contextlib
+import cProfile
+import tracemalloc
+
+# Profiling is switched on from the environment, no code changes needed:
+#   EXERCISE_PROFILE=1                  record stages, write a JSON report
+#   EXERCISE_PROFILE_REPORT=<path>      where the JSON report is written
+#   EXERCISE_PROFILE_CPROFILE=<path>    also dump cProfile stats of the run
+#   EXERCISE_PROFILE_MEMORY=0           skip tracemalloc, which slows stages
+PROFILE_ENABLED = os.environ.get("EXERCISE_PROFILE", "0") == "1"
+PROFILE_MEMORY = os.environ.get("EXERCISE_PROFILE_MEMORY", "1") == "1"
+PROFILE_REPORT = os.environ.get("EXERCISE_PROFILE_REPORT",
+                                "exercise_profile.json")
+PROFILE_CPROFILE = os.environ.get("EXERCISE_PROFILE_CPROFILE")
+
+# Records of the current process, as dictionaries with a "stage" key. Stages
+# timed in worker processes are sent back with the results and merged.
+RECORDS = []
+
+# Stages being timed, innermost last, to carry memory peaks outwards.
+STAGE_STACK = []
+
+# Run started by start_run, with its profiler if cProfile is on.
+RUN = {}
+
+'''
+Time a stage of the pipeline. Yields the record, so the caller can set
+rows_out or other counts before it is stored. Records wall time and, with
+tracemalloc, the peak of traced memory during the stage. Does nothing
+when profiling is off.
+'''
+@contextlib.contextmanager
+def stage(name, table=None, column=None, rows_in=None):
+    record = {"stage": name, "table": table, "column": column,
+              "rows_in": rows_in, "rows_out": None}
+    if not PROFILE_ENABLED:
+        yield record
+        return
+
+    if PROFILE_MEMORY:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # The enclosing stage keeps its peak so far, which the reset clears
+        if STAGE_STACK:
+            STAGE_STACK[-1]["_peak"] = max(STAGE_STACK[-1].get("_peak", 0),
+                                           tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    STAGE_STACK.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["secs"] = time.perf_counter() - start
+        STAGE_STACK.pop()
+
+        # Inner stages reset the peak, so theirs and the peak before each
+        # of them count towards this one
+        record["peak_bytes"] = None
+        if PROFILE_MEMORY:
+            record["peak_bytes"] = max(tracemalloc.get_traced_memory()[1],
+                                       record.pop("_peak", 0))
+            if STAGE_STACK:
+                STAGE_STACK[-1]["_peak"] = max(
+                    STAGE_STACK[-1].get("_peak", 0), record["peak_bytes"])
+        RECORDS.append(record)
+
+# Record a histogram, e.g. of duplicate group sizes, as size: count.
+def histogram(name, table, counts):
+    if PROFILE_ENABLED:
+        RECORDS.append({"stage": name, "table": table,
+                        "histogram": {int(k): int(v)
+                                      for k, v in counts.items()}})
+
+# Record the memory of a table in bytes, as read and after QC.
+def table_memory(table, bytes_read, bytes_qc):
+    if PROFILE_ENABLED:
+        RECORDS.append({"stage": "table_memory", "table": table,
+                        "bytes_read": bytes_read, "bytes_qc": bytes_qc})
+
+# Position in RECORDS, to take the records made after it with take_since.
+def mark():
+    return len(RECORDS)
+
+# Remove and return the records made since mark, e.g. to return them from
+# a worker process with its results.
+def take_since(position):
+    records = RECORDS[position:]
+    del RECORDS[position:]
+    return records
+
+# Add records taken in another process, or by take_since.
+def merge(records):
+    RECORDS.extend(records or [])
+
+# Start a run: clear records and start tracemalloc and cProfile as set.
+# Tracing started here is stopped by finish_run.
+def start_run(name):
+    RECORDS.clear()
+    RUN.clear()
+    RUN.update(name=name, start=time.perf_counter(),
+               started_at=datetime.datetime.now().isoformat())
+    if PROFILE_ENABLED and PROFILE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        RUN["tracing"] = True
+    if PROFILE_CPROFILE:
+        RUN["profiler"] = cProfile.Profile()
+        RUN["profiler"].enable()
+
+'''
+Finish the run and write its JSON report with every record, total seconds
+per stage, duplicate group histograms, table memory and peak memory. Peak
+RSS is of this process and, separately, of its finished worker processes
+where the OS reports it. Tracing started by start_run is stopped, so later
+allocations of the process are not traced.
+'''
+def finish_run():
+    if "profiler" in RUN:
+        RUN["profiler"].disable()
+        RUN["profiler"].dump_stats(PROFILE_CPROFILE)
+        print(f"cProfile stats written to {PROFILE_CPROFILE}")
+    if not PROFILE_ENABLED:
+        return
+
+    stages = [r for r in RECORDS if "secs" in r]
+    totals = {}
+    for record in stages:
+        totals[record["stage"]] = totals.get(record["stage"], 0) \
+            + record["secs"]
+
+    dup_groups = {}
+    for record in RECORDS:
+        if "histogram" in record:
+            hist = dup_groups.setdefault(record["table"], {})
+            for size, count in record["histogram"].items():
+                hist[size] = hist.get(size, 0) + count
+
+    table_bytes = {r["table"]: {"read": r["bytes_read"], "qc": r["bytes_qc"]}
+                   for r in RECORDS if r["stage"] == "table_memory"}
+
+    report = {
+        "run": RUN.get("name"),
+        "started_at": RUN.get("started_at"),
+        "secs": time.perf_counter() - RUN.get("start", time.perf_counter()),
+        "peak_traced_bytes": tracemalloc.get_traced_memory()[1] 
+            if PROFILE_MEMORY else None,
+        "max_rss_bytes": get_max_rss(),
+        "stage_secs": totals,
+        "dup_groups": dup_groups,
+        "table_bytes": table_bytes,
+        "stages": stages,
+    }
+    if RUN.pop("tracing", False):
+        tracemalloc.stop()
+    with open(PROFILE_REPORT, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Profile report written to {PROFILE_REPORT}")
+
+# Peak RSS of this process and its workers, None where unavailable.
+def get_max_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # Linux reports kilobytes, macOS bytes
+    scale = 1 if os.uname().sysname == "Darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children":
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+# Profile a whole run of func when profiling or cProfile is switched on.
+def profiled_run(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not (PROFILE_ENABLED or PROFILE_CPROFILE):
+            return func(*args, **kwargs)
+
+        start_run(func.__name__)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            finish_run()
+    return wrapper
@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 import gc
 import re
+import collections
+import functools
+import importlib
+import itertools
 import warnings
 import numpy as np
 import exercise_util
+import exercise_util_profile as prof
 import sqlalchemy as alch
 import pandas as pd
 import pandera as pa
 import pandas.api.types as pd_types
+from concurrent.futures import ProcessPoolExecutor
 from dateutil import parser
 
 # Suppress FutureWarnings... from Pandas...
@@ -18,52 +24,135 @@ warnings.filterwarnings(action='ignore',
 CHECK_NUMERIC = pa.Check(
     lambda x: pd_types.is_float(x),
     element_wise=True,
+    name='numeric',
 )
 
 CHECK_DATETIME = pa.Check(
     lambda x: pd_types.is_datetime64_any_dtype(x),
     element_wise=False,
+    name='datetime',
 )
 
 CHECK_INT = pa.Check(
     lambda x: pd_types.is_integer_dtype(x),
     element_wise=False,
+    name='int',
 )
 
 CHECK_STRING = pa.Check(
     lambda x: pd_types.is_string_dtype(x)
         or x == pd.NA,
     element_wise=False,
+    name='string',
 )
 
-# Get the datatypes for each column in the table as array.
+# How cleaned columns are validated. 'fast' checks the dtype of the whole 
+# series once, 'pandera' runs the checks above through a SeriesSchema.
+VALIDATION_MODE = 'fast'
+
+# dtype-level version of each check for 'fast' mode, by check name.
+FAST_CHECKS = {
+    'numeric': pd_types.is_float_dtype,
+    'datetime': pd_types.is_datetime64_any_dtype,
+    'int': pd_types.is_integer_dtype,
+    'string': pd_types.is_string_dtype,
+}
+
+# Allowed (min, max) of columns, None for no bound. Values outside are 
+# counted in the validation report, not changed.
+VALIDATION_RANGES = {
+    'final_quantity': (0, None),
+    'final_sale': (0, None),
+}
+
+# How tables are held in memory during and after QC. 'default' keeps strings
+# as Python objects and numbers as 64-bit. 'lean' reads CATEGORY_COLS as 
+# categoricals, keeps other strings as Arrow strings and downcasts numbers
+# where no value changes. Both load the same values into the database.
+DTYPE_MODE = 'default'
+
+# Low-cardinality string columns held as categoricals in 'lean' mode.
+CATEGORY_COLS = ['store_name', 'state', 'language', 'gender', 'brand', 
+                 'manufacturer', 'category_1', 'category_2', 'category_3', 
+                 'category_4']
+
+# Nullable dtypes tried in order when downcasting in 'lean' mode.
+LEAN_INT_DTYPES = [pd.Int8Dtype(), pd.Int16Dtype(), pd.Int32Dtype()]
+LEAN_FLOAT_DTYPES = [pd.Float32Dtype()]
+
+# Patterns used to confirm identifiers in clean_string.
+REGEX_RECEIPT_ID = re.compile(r'(?i)[a-z0-9]{8}(?:-[a-z0-9]{4}){3}-[a-z0-9]{12}')
+REGEX_USER_ID = re.compile(r'(?i)[a-z0-9]{24}')
+
+# Specific match and replace for gender values.
+def clean_gender(series):
+    # For 'non-binary' patterns
+    series = series.replace(r'(?i)(non).*(binary)\s', 
+                            'non-binary', regex=True).astype(np.dtype(str))
+    # For 'not listed' patterns
+    series = series.replace(r'(?i)(not).*((list)|(specifi)).*', 
+                            'not listed', regex=True).astype(np.dtype(str))
+    # For 'prefer not to say' patterns
+    series = series.replace(r'(?i)(prefer).*(not).*', 
+                            'not listed', regex=True).astype(np.dtype(str))
+    return series
+
+def get_string_regex(regex_for=None):
+    if regex_for == 'receipt_id':
+        return REGEX_RECEIPT_ID
+    
+    # Matching for user_id or id (USER_TAKEHOME)
+    elif (regex_for == 'user_id') or (regex_for == 'id'):
+        return REGEX_USER_ID
+    
+    return None
+
+'''
+Vectorized string cleaning over the whole column. Values of 'nan' 
+(nulls after the string conversion) become np.nan, the rest are trimmed.
+Identifier columns are only confirmed against their pattern and kept as
+they were, which is what the per-row loop did with re.search().string.
+'''
 def clean_string(series, regex_for=None):  
     
+    # Nulls of string and categorical dtypes don't convert to 'nan'
+    bool_null = series.isna().values
+    
     # Convert to Series dtype to string first
     series = series.astype(np.dtype(str))
+    regex = get_string_regex(regex_for)
+    if (regex is None) and (series.name == 'gender'):
+        series = clean_gender(series)
+   
+    # Control for null values written as string 'nan'
+    bool_nan = (series == 'nan').values | bool_null
     
-    if regex_for == 'receipt_id':
-        regex = r'(?i)[a-z0-9]{8}(-[a-z0-9]{4}){3}-[a-z0-9]{12}'
+    if regex is None:
+        # Do left and right cleaning on all values at once
+        series_clean = series.str.strip()
+    else:
+        # Every identifier must contain the pattern, same as the loop
+        bool_match = series.str.contains(regex).values
+        bool_miss = ~(bool_match | bool_nan)
+        if bool_miss.any():
+            raise ValueError(
+                f'{series.name} has {bool_miss.sum()} value(s) not matching '
+                f'{regex.pattern}, e.g. {series[bool_miss].iloc[0]!r}'
+            )
+        series_clean = series.copy()
     
-    # Matching for user_id or id (USER_TAKEHOME)
-    elif (regex_for == 'user_id') or (regex_for == 'id'):
-        regex = r'(?i)[a-z0-9]{24}'
-    
-    # Specific match and replace for gender values.
-    elif series.name == 'gender':
-        # For 'non-binary' patterns
-        series = series.replace(r'(?i)(non).*(binary)\s', 
-                                'non-binary', regex=True).astype(np.dtype(str))
-        # For 'not listed' patterns
-        series = series.replace(r'(?i)(not).*((list)|(specifi))', 
-                                'not listed', regex=True).astype(np.dtype(str))
-        # For 'prefer not to say' patterns
-        series = series.replace(r'(?i)(prefer).*(not).*', 
-                                'not listed', regex=True).astype(np.dtype(str))
+    series_clean[bool_nan] = np.nan
+    return series_clean
+
+# Per-row version of clean_string, kept as reference for benchmarks.
+def clean_string_loop(series, regex_for=None):  
+    
+    # Convert to Series dtype to string first
+    series = series.astype(np.dtype(str))
+    regex = get_string_regex(regex_for)
+    if (regex is None) and (series.name == 'gender'):
+        series = clean_gender(series)
    
-    # Validation has to be done first because of nulls and strings in pa.Check
-    # Wont affect result but will throw long warning prints..
-    series = validate_series(series, CHECK_STRING)
     for i, val in series.items():
         
         # Control for null values written as string 'nan'
@@ -75,58 +164,180 @@ def clean_string(series, regex_for=None):
         series.loc[i] = re.sub(r'^\s+|\s+$', '', val)
             
         # Do pattern targeting to get those values from string
-        if regex_for != None:
+        if regex != None:
             series.loc[i] = re.search(regex,val).string
            
     return series
 
+# Datetime formats found in the source CSV as (regex, format, is_utc). Each 
+# group is parsed with a single pd.to_datetime call.
+DATETIME_FORMATS = [
+    # UTC timestamps, e.g. '2024-08-21 14:19:06.539 Z'
+    (re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:\.\d+)? ?Z'),
+     'ISO8601', True),
+    # ISO8601 without time zone, e.g. '2024-08-21T14:19:06'
+    (re.compile(r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?'),
+     'ISO8601', False),
+    # Date only, e.g. '2024-08-21'
+    (re.compile(r'\d{4}-\d{2}-\d{2}'),
+     '%Y-%m-%d', False),
+]
+
+# Count of values per column that had to fall back to dateutil.
+DATETIME_FALLBACKS = collections.Counter()
+
+# Counts made in DATETIME_FALLBACKS since a copy of it. They are removed, so
+# they can go back with a result from a worker process and be merged again.
+def take_fallbacks_since(counts_before):
+    counts = DATETIME_FALLBACKS - counts_before
+    DATETIME_FALLBACKS.subtract(counts)
+    return dict(counts)
+
+# Add counts taken in another process, or by take_fallbacks_since.
+def merge_fallbacks(counts):
+    DATETIME_FALLBACKS.update(counts or {})
+
+# Multi-purpose parser for UTC or ISO8601 datetime strings. Time zones are
+# kept as UTC to line up with the vectorized formats.
+def parse_datetime(val):
+    timestamp = pd.Timestamp(parser.parse(val))
+    if timestamp.tz is not None:
+        timestamp = timestamp.tz_convert('UTC')
+    return timestamp
+
+'''
+Parse datetime strings in bulk. Each distinct string is parsed once and
+mapped back to the series, so repeated scan dates cost nothing. Strings
+not matching DATETIME_FORMATS are parsed by dateutil and counted.
+'''
+def parse_datetime_strings(series):
+    
+    bool_str = (series.map(type) == str).values
+    if not bool_str.any():
+        return series
+    
+    # Distinct raw strings left to parse
+    remaining = pd.Series(pd.unique(series.values[bool_str]))
+    arr_parsed = []
+    
+    for regex, fmt, is_utc in DATETIME_FORMATS:
+        bool_fmt = remaining.str.fullmatch(regex).values
+        group = remaining[bool_fmt]
+        remaining = remaining[~bool_fmt]
+        if group.empty:
+            continue
+        
+        if is_utc:
+            parsed = pd.to_datetime(group.str.replace(r' ?Z$', '', regex=True),
+                                    format=fmt, errors='coerce')
+            parsed = parsed.dt.tz_localize('UTC')
+        else:
+            parsed = pd.to_datetime(group, format=fmt, errors='coerce')
+        
+        # Strings that look right but still fail go to dateutil
+        bool_failed = parsed.isna().values
+        remaining = pd.concat([remaining, group[bool_failed]])
+        arr_parsed.append(parsed[~bool_failed].set_axis(group[~bool_failed]))
+    
+    # Fall back to dateutil for the stragglers
+    if not remaining.empty:
+        arr_parsed.append(pd.Series(
+            [parse_datetime(val) for val in remaining],
+            index=remaining.values,
+        ))
+        c_fallback = int(series.isin(remaining).sum())
+        DATETIME_FALLBACKS[series.name] += c_fallback
+        print(f'\t\t\t... {c_fallback} value(s) in {series.name}',
+              'parsed with dateutil')
+    
+    # Map parsed values back and leave non-strings as they were
+    series_parsed = series.map(pd.concat(arr_parsed))
+    if not bool_str.all():
+        series_parsed = series_parsed.where(bool_str, series)
+    return series_parsed
+
 def clean_datetime(series):
 
-    # Need to iterate due to issue with converting to dtype 
-    # from ISO/UTC string inputs
-    for i, val in series.items():
-  
-        # Multi-purpose parser for UTC or ISO8601 datetime strings
-        if (val is not np.nan) and (type(val) == str):
-            series.loc[i] = pd.Timestamp(parser.parse(val))
-        elif (val is None):     # Control for null values
-            series.loc[i] = np.nan
+    # Parse ISO/UTC string inputs before converting dtype
+    if series.dtype == object:
+        series = parse_datetime_strings(series)
         
     # Convert dtype of entire pd.Series
     series = pd.to_datetime(series)
-    series = validate_series(series, CHECK_DATETIME) 
     return series
 
 def clean_int(series):
     series = series.replace("-1", np.nan)
     series = series.astype(pd.Int64Dtype())
-    series = validate_series(series, CHECK_INT)
     return series
 
 def clean_numeric(series):
     series = series.replace("zero", np.nan)  
     series = series.astype(pd.Float64Dtype())
-    series = validate_series(series, CHECK_NUMERIC)
     return series
 
-# Validtes the series based on pre-determined check parameters.
+'''
+Validates a cleaned series against a check and VALIDATION_RANGES. Returns 
+the number of failing values as check_name: count, plus 'range' for 
+columns with a range. Nulls are allowed. A dtype failure in 'fast' mode 
+counts every non-null value.
+'''
 def validate_series(series, check_type):
-    schema = pa.SeriesSchema(
-        checks=check_type,
+    
+    if VALIDATION_MODE == 'fast':
+        bool_dtype = FAST_CHECKS[check_type.name](series.dropna())
+        failures = {check_type.name: 0 if bool_dtype 
+                    else int(series.notna().sum())}
+    else:
+        failures = {check_type.name: validate_pandera(series, check_type)}
+    
+    # Ranges only apply to values that passed as numbers
+    if (series.name in VALIDATION_RANGES) \
+            and pd_types.is_numeric_dtype(series):
+        low, high = VALIDATION_RANGES[series.name]
+        bool_out = np.zeros(series.shape[0], dtype=bool)
+        if low is not None:
+            bool_out |= (series < low).fillna(False).to_numpy(dtype=bool)
+        if high is not None:
+            bool_out |= (series > high).fillna(False).to_numpy(dtype=bool)
+        failures['range'] = int(bool_out.sum())
+    
+    return failures
+
+# Schema of a check, built once per process and reused for every column.
+@functools.lru_cache
+def get_series_schema(check_name):
+    check_type = {check.name: check for check in 
+                  [CHECK_NUMERIC, CHECK_DATETIME, CHECK_INT, CHECK_STRING]}
+    return pa.SeriesSchema(
+        checks=check_type[check_name],
         nullable=True,  # Series can contain nulls.
         unique=False,   # Duplicates are okay in series.
         coerce=False   # See if dtype is validated without coercion.
-    )   
+    )
+
+# Number of values failing a check with the pandera schema.
+def validate_pandera(series, check_type):
+    schema = get_series_schema(check_type.name)
     try:
-        schema.validate(check_obj=series, inplace=True,)
-    except Exception as e:
-        print(f'VALIDATION FAILED ==> {e}')
-        
-    return series
+        schema.validate(check_obj=series, lazy=True, inplace=True)
+    except pa.errors.SchemaErrors as e:
+        return max(len(e.failure_cases), 1)
+    return 0
+
+# How duplicate groups are reconciled. 'columnar' compares the NumPy arrays
+# of the group, 'series' compares rows as pd.Series with sub_recur.
+RECONCILE_MODE = 'columnar'
 
 def reconcile(df_subset, table=None):
 # Reconcile differences in values
     
+    if RECONCILE_MODE == 'columnar':
+        values = df_subset.to_numpy(dtype=object)
+        nulls = pd.isna(values)
+        rec = reconcile_arrays(values, nulls, np.where(nulls, None, values))
+        return pd.DataFrame([rec], index=[0], columns=df_subset.columns)
+    
     # Create array of records and run recursive comparison
     arr_rows = [x for i, x in df_subset.iterrows()]
     arr_reconciled = sub_recur(arr_rows)
@@ -212,6 +423,74 @@ def sub_recur(arr):
         arr = arr_tmp
         return arr
  
+'''
+Same reconciliation as sub_recur but on the arrays of the whole group.
+Each row is a tuple of (values, null mask, comparable values), where the
+comparable values have nulls swapped for None so pd.NA is never compared.
+Like reconcile, only the last reconciled record is kept.
+'''
+def reconcile_arrays(values, nulls, comparable):
+    arr_rows = list(zip(values, nulls, comparable))
+    arr_reconciled = sub_recur_arrays(arr_rows)
+    return arr_reconciled[-1][0]
+
+# Yields the accession and reconciled records for every duplicate group.
+def reconcile_groups(df_dups, accession):
+    
+    if RECONCILE_MODE != 'columnar':
+        for acc, df_subset in df_dups.groupby(accession, sort=False):
+            yield acc, reconcile(df_subset).to_numpy(dtype=object).tolist()
+        return
+    
+    # Null masks and comparable values are built once for all groups
+    values = df_dups.to_numpy(dtype=object)
+    nulls = pd.isna(values)
+    comparable = np.where(nulls, None, values)
+    
+    groups = df_dups.groupby(accession, sort=False).indices
+    for acc, idx in groups.items():
+        yield acc, [reconcile_arrays(values[idx], nulls[idx], comparable[idx])]
+
+def sub_compare_arrays(left, right):
+    
+    left_vals, left_nulls, left_cmp = left
+    right_vals, right_nulls, right_cmp = right
+    
+    # Columns where both sides have a value and the values differ
+    conflicts = ~((left_cmp == right_cmp) | left_nulls | right_nulls)
+    
+    if conflicts.any():
+        return [left, right]
+    
+    # Same as left.combine_first(right)
+    return [(np.where(left_nulls, right_vals, left_vals),
+             left_nulls & right_nulls,
+             np.where(left_nulls, right_cmp, left_cmp))]
+
+# Same as (x == y).all() on pd.Series, where nulls never compare equal.
+def sub_equal_arrays(x, y):
+    return bool(((x[2] == y[2]) & ~x[1] & ~y[1]).all())
+
+def sub_recur_arrays(arr):
+    
+    if len(arr) == 1:
+        return arr
+    
+    if len(arr) == 2:
+        return sub_compare_arrays(arr[0], arr[1])
+    
+    # Same recursion and comb sort as sub_recur
+    mid = len(arr) // 2
+    arr = sub_recur_arrays(arr[:mid]) + sub_recur_arrays(arr[mid:])
+    arr_tmp = []
+    for i in range(len(arr)):
+        arr_run = sub_compare_arrays(arr[i], arr[(i - 1) // 2])
+        for x in arr_run:
+            if not any(sub_equal_arrays(x, y) for y in arr_tmp):
+                arr_tmp.append(x)
+    
+    return arr_tmp
+
 # Returns column names that are keys for grouping
 def get_unique_req(table):
     
@@ -281,82 +560,261 @@ def qc_by_row(df_tbl, table):
         print(f'\tNo duplications found in {table}!')
         return df_tbl
     
+    # Rows in df_tbl per duplicated accession, including non-duplicates
+    c_acc_rows = df_tbl[accession].value_counts()
+    c_acc_rows = c_acc_rows[c_acc_rows.index.isin(df_dups[accession])]
+    prof.histogram('dup_groups', table, c_acc_rows.value_counts())
+    
     print(f'\tPerforming recursive comparison on {table}...', 
           'WARNING: This might take a while...', sep='\t')
     
-    # Iterate through each unique accession value in df_dups
-    for acc in df_dups[accession].unique():
+    # Partition duplicates once by accession and reconcile each group
+    arr_reconciled = []
+    c_row_kept = c_row_start
+    for acc, arr_records in reconcile_groups(df_dups, accession):
+        arr_reconciled += arr_records
         
-        # Create subset from df_dups of rows with accession value
-        df_subset = df_dups.loc[df_dups[accession] == acc]
-                
-        # Pass df_subset to reconcile method
-        df_reconciled = reconcile(df_subset)
-                
-        # Drop all rows with the duplicate accession
-        df_tbl = df_tbl[df_tbl[accession] != acc]
-        
-        # Append df_reconciled as rows to df_tbl
-        df_tbl = pd.concat([df_tbl,df_reconciled], ignore_index=True, axis=0)
-        
-        print(f'\t\t... Keeping {df_tbl.shape[0]} out of',
+        # Same count as dropping every row with the accession and 
+        # appending the reconciled rows
+        c_row_kept += len(arr_records) - c_acc_rows[acc]
+        print(f'\t\t... Keeping {c_row_kept} out of',
               f' {c_row_start} row(s)', end='\r', sep='')
     
+    df_reconciled = pd.DataFrame(arr_reconciled, columns=df_tbl.columns)
+    df_reconciled = df_reconciled.astype(df_dups.dtypes.to_dict())
+    
+    # Drop all rows with a duplicate accession and append reconciled rows
+    df_tbl = df_tbl[~df_tbl[accession].isin(c_acc_rows.index).values]
+    df_tbl = pd.concat([df_tbl, df_reconciled], ignore_index=True, axis=0)
+    
     rows_removed = c_row_start-df_tbl.shape[0]
     print(f'\n\t\t\t... Removed total of {rows_removed} rows from {table}')
     
     return df_tbl
 
 
+# Columns with preconstructed regex patterns to use
+REGEX_COLS = ['receipt_id', 'user_id', 'id']
+
+# Clean a single column. Kept at module level to run in a process pool.
+def qc_column(series, table):
+    col_name = series.name
+    position = prof.mark()
+    fallbacks_before = DATETIME_FALLBACKS.copy()
+    with prof.stage('qc_column', table, col_name, 
+                    rows_in=series.shape[0]) as record:
+        series_clean = qc_column_types(series, table)
+        record['rows_out'] = series_clean.shape[0]
+    
+    # Failure counts and stage records travel with the series, also from
+    # a process pool
+    validation = validate_series(series_clean, 
+                                 get_column_check(table, col_name))
+    if DTYPE_MODE == 'lean':
+        series_clean = compact_series(series_clean, table)
+    series_clean.attrs['validation'] = validation
+    series_clean.attrs['profile'] = prof.take_since(position)
+    series_clean.attrs['datetime_fallbacks'] = take_fallbacks_since(
+        fallbacks_before)
+    return series_clean
+
+# Check of a column for validate_series, from its type in TABLES.
+def get_column_check(table, col_name):
+    match exercise_util.TABLES.get(table).get(col_name):
+        case alch.types.String:
+            return CHECK_STRING
+        case alch.types.Integer:
+            return CHECK_INT
+        case alch.types.Numeric:
+            return CHECK_NUMERIC
+        case alch.types.DateTime:
+            return CHECK_DATETIME
+
+# Clean a single column with the clean_* function of its type in TABLES.
+def qc_column_types(series, table):
+    col_name = series.name
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return qc_categories(series, table)
+    
+    # Replace whitespace as None for all columns
+    series = series.replace(r'^\s*$', np.nan, regex=True)
+    print(f'\t\t... {table}.{col_name}')
+    
+    # QC for specific dtypes
+    match exercise_util.TABLES.get(table).get(col_name):
+        case alch.types.String:
+            regex_for = None
+            if col_name in REGEX_COLS:
+                regex_for = col_name
+            series_clean = clean_string(series, regex_for)
+        case alch.types.Integer:
+            series_clean = clean_int(series)
+        case alch.types.Numeric:
+            series_clean = clean_numeric(series)
+        case alch.types.DateTime:
+            series_clean = clean_datetime(series)
+    
+    return series_clean
+
+'''
+Clean a categorical string column through its categories. Cleaning is per
+value, so each distinct value is cleaned once and mapped back by its code.
+Returns an object series whose rows share the cleaned strings.
+'''
+def qc_categories(series, table):
+    categories = pd.Series(series.cat.categories.astype(object), 
+                           name=series.name)
+    cleaned = qc_column_types(categories, table).to_numpy(dtype=object)
+    
+    codes = series.cat.codes.to_numpy()
+    values = np.where(codes >= 0, cleaned[codes], np.nan)
+    return pd.Series(values, index=series.index, name=series.name)
+
+# Dtypes for read_csv, so 'lean' mode never holds CATEGORY_COLS as objects.
+def get_read_dtypes(table):
+    if DTYPE_MODE != 'lean':
+        return None
+    return {col_name: 'category' for col_name in exercise_util.TABLES[table]
+            if col_name in CATEGORY_COLS}
+
+# Compact dtype of a cleaned column for 'lean' mode, by its type in TABLES.
+def compact_series(series, table):
+    match exercise_util.TABLES.get(table).get(series.name):
+        case alch.types.String:
+            if series.name in CATEGORY_COLS:
+                return series.astype('category')
+            return series.astype(pd.StringDtype('pyarrow'))
+        case alch.types.Integer:
+            return downcast_series(series, LEAN_INT_DTYPES)
+        case alch.types.Numeric:
+            return downcast_series(series, LEAN_FLOAT_DTYPES)
+    return series
+
+# Series in the first of dtypes that holds every value exactly, else as is.
+def downcast_series(series, dtypes):
+    for dtype in dtypes:
+        try:
+            series_down = series.astype(dtype)
+        except (TypeError, ValueError, OverflowError):
+            continue
+        if series_down.astype(series.dtype).equals(series):
+            return series_down
+    return series
+
+# Bytes held by a DataFrame, including the Python strings it points to.
+def get_memory(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
 '''
 Function for quality control on data. Will also set datatypes and 
-confirm that values adhere to the datatype. 
+confirm that values adhere to the datatype. Columns are independent, so
+with an executor they are cleaned in parallel processes. Failure counts of
+each column are kept in df_tbl.attrs['validation'] as column: counts.
 '''
-def qc_table(df_tbl, table):  
+def qc_table(df_tbl, table, executor=None):  
     # Garbage collection to free up memory
     gc.collect() 
     
-    # Columns with preconstructed regex patterns to use
-    regex_cols = ['receipt_id', 'user_id', 'id']
-    
     print('\tPerforming QC and validation on...')
-    for col_name, series in df_tbl.items():
-        # Garbage collection to free up memory
-        gc.collect()
-                
-        # Replace whitespace as None for all columns
-        series = series.replace(r'^\s*$', np.nan, regex=True)
-        print(f'\t\t... {table}.{col_name}')
-        
-        # QC for specific dtypes
-        match exercise_util.TABLES.get(table).get(col_name):
-            case alch.types.String:
-                regex_for = None
-                if col_name in regex_cols:
-                    regex_for = col_name
-                series_clean = clean_string(series, regex_for)
-            case alch.types.Integer:
-                series_clean = clean_int(series)
-            case alch.types.Numeric:
-                series_clean = clean_numeric(series)
-            case alch.types.DateTime:
-                series_clean = clean_datetime(series)
-
-        # Replace uncleaned series with cleaned series
-        df_tbl[col_name] = series_clean.iloc[:]
-        
+    report = {}
+    if executor is not None:
+        arr_series = executor.map(qc_column, 
+                                  [series for _, series in df_tbl.items()],
+                                  itertools.repeat(table))
+        for series_clean in arr_series:
+            report[series_clean.name] = series_clean.attrs['validation']
+            prof.merge(series_clean.attrs['profile'])
+            merge_fallbacks(series_clean.attrs['datetime_fallbacks'])
+            df_tbl[series_clean.name] = series_clean.iloc[:]
+    else:
+        for col_name, series in df_tbl.items():
+            # Garbage collection to free up memory
+            gc.collect()
+            
+            # Replace uncleaned series with cleaned series
+            series_clean = qc_column(series, table)
+            report[col_name] = series_clean.attrs['validation']
+            prof.merge(series_clean.attrs['profile'])
+            merge_fallbacks(series_clean.attrs['datetime_fallbacks'])
+            df_tbl[col_name] = series_clean.iloc[:]
+    
+    df_tbl.attrs['validation'] = report
+    print_validation(report, table)
     return df_tbl
 
+# Print the columns of a validation report with failing values.
+def print_validation(report, table):
+    for col_name, failures in report.items():
+        failed = {k: v for k, v in failures.items() if v}
+        if failed:
+            print(f'\t\t... VALIDATION FAILED ==> {table}.{col_name}:',
+                  ', '.join(f'{v} {k}' for k, v in failed.items()))
+
+
+# Settings read in QC worker processes, as module: names. Workers started 
+# with spawn (Windows) import the modules again, so the values set in the
+# parent at runtime are passed to each worker by init_worker.
+WORKER_SETTINGS = {
+    'exercise_util': ['PATH_CSV', 'TABLES'],
+    'exercise_util_qc': ['DTYPE_MODE', 'CATEGORY_COLS', 'VALIDATION_MODE',
+                         'VALIDATION_RANGES', 'RECONCILE_MODE'],
+    'exercise_util_profile': ['PROFILE_ENABLED', 'PROFILE_MEMORY'],
+}
+
+# Current values of WORKER_SETTINGS, as module: {name: value}.
+def get_worker_settings():
+    return {module_name: {name: getattr(importlib.import_module(module_name), 
+                                        name) for name in names}
+            for module_name, names in WORKER_SETTINGS.items()}
+
+# Initializer of QC worker processes, sets the values of the parent.
+def init_worker(settings):
+    for module_name, values in settings.items():
+        module = importlib.import_module(module_name)
+        for name, value in values.items():
+            setattr(module, name, value)
 
-def qc_controller(df_tbl, table):
+# Process pool for QC whose workers start with the settings of this process.
+def create_executor(workers):
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                               initargs=(get_worker_settings(),))
+
+'''
+Clean, reconcile and clean again a table read from its CSV. In 'lean' mode
+or when profiling, the memory of the table as read and after QC is printed
+and recorded.
+'''
+def qc_controller(df_tbl, table, workers=1):
+    
+    report_memory = (DTYPE_MODE == 'lean') or prof.PROFILE_ENABLED
+    if report_memory:
+        bytes_read = get_memory(df_tbl)
     
-    # Make sure dtype is right before curation
-    df_tbl = qc_table(df_tbl, table)
+    # Process pool for column cleaning, shared by both qc_table passes
+    executor = None
+    if workers > 1:
+        executor = create_executor(workers)
     
-    # Curate records for issues
-    df_tbl = qc_by_row(df_tbl, table)
+    try:
+        # Make sure dtype is right before curation
+        df_tbl = qc_table(df_tbl, table, executor)
+        
+        # Curate records for issues
+        with prof.stage('qc_by_row', table, rows_in=df_tbl.shape[0]) as record:
+            df_tbl = qc_by_row(df_tbl, table)
+            record['rows_out'] = df_tbl.shape[0]
+        
+        # Run once more through qc_table before returning
+        df_tbl = qc_table(df_tbl, table, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
     
-    # Run once more through qc_table before returning
-    df_tbl = qc_table(df_tbl, table)
+    if report_memory:
+        bytes_qc = get_memory(df_tbl)
+        prof.table_memory(table, bytes_read, bytes_qc)
+        print(f'\tMemory of {table} ({DTYPE_MODE} dtypes):',
+              f'{bytes_read / 2**20:,.1f} MB as read,',
+              f'{bytes_qc / 2**20:,.1f} MB after QC')
     
     return df_tbl
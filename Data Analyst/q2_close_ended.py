@@ -1,11 +1,25 @@
 #!/usr/bin/env python3
 import exercise_util
 import sqlalchemy as alch
-import pandas as pd
 import plotly.express as px
 import tabulate as tab
 
 
+# Same query over the fact table, where account age is precomputed.
+SQL_QUERY_FACT = alch.text(
+    f"""
+    SELECT brand,
+        SUM(final_sale) AS total_sales
+    FROM {exercise_util.FACT_TABLE}
+    WHERE (account_age_days >= 183)
+        AND (brand IS NOT NULL)
+        AND (final_quantity > 0)
+    GROUP BY brand
+    ORDER BY total_sales DESC
+    LIMIT 5
+    """
+)
+
 """
 Query SQL database for the following with one query:
     What are the top 5 brands by sales among users that have had 
@@ -16,16 +30,20 @@ def run_query(engine):
     print('Running query for Close-Ended, Question 2...')
     with engine.connect() as conn:
     
+        # Account age in days, in the date functions of the database
+        account_age_days = exercise_util.sql_function(
+            conn, 'days_between', 't.scan_date', 'u.created_date')
+    
         # Common Table Expression (CTE) approach
         sql_query = alch.text(
-            """
+            f"""
             WITH qualified_transactions AS (
                 SELECT barcode,
                     final_quantity,
                     final_sale
                 FROM TRANSACTION_TAKEHOME t
                     LEFT JOIN USER_TAKEHOME u ON t.user_id = u.id
-                WHERE JULIANDAY(t.scan_date) - JULIANDAY(u.created_date) >= 183
+                WHERE {account_age_days} >= 183
             )
             SELECT p.brand,
                 SUM(final_sale) AS total_sales
@@ -39,17 +57,18 @@ def run_query(engine):
             """
         ) 
         
-        # Execute query to database and crate
-        df_query_result = pd.DataFrame(
-            conn.execute(sql_query).fetchall()
-        )
+        # Single-table version of the query over the fact table
+        if exercise_util.use_fact_table(conn):
+            sql_query = SQL_QUERY_FACT
+        
+        # Execute query to database, or read from cache if unchanged
+        df_query_result = exercise_util.cached_query(conn, sql_query)
      
         # Print results in console.
         print(tab.tabulate(df_query_result, 
                         headers=df_query_result.columns.values, 
                         tablefmt='psql',
                         showindex=False))
-        engine.dispose()
         
     '''
     Bar chart created with Plotly and will show in browser window. 
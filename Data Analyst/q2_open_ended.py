@@ -1,11 +1,143 @@
 #!/usr/bin/env python3
 import exercise_util
 import sqlalchemy as alch
-import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 import tabulate as tab
 
+'''
+Users per barcode are aggregated once for the Dips & Salsa barcodes and 
+joined to the transactions, instead of a correlated subquery per row.
+users_in_table counts transactions whose barcode was scanned by any user
+in USER_TAKEHOME, same as SQL_QUERY_CORRELATED.
+'''
+SQL_QUERY = alch.text(
+    """
+    WITH barcode_users AS (
+        SELECT t2.barcode,
+            COUNT(DISTINCT u.id) AS count_users
+        FROM USER_TAKEHOME u
+            JOIN TRANSACTION_TAKEHOME t2 ON u.id = t2.user_id
+        WHERE t2.barcode IN (
+            SELECT barcode
+            FROM PRODUCTS_TAKEHOME
+            WHERE category_2 = 'Dips & Salsa'
+        )
+        GROUP BY t2.barcode
+    )
+    SELECT p.brand,
+        MAX(CASE
+            WHEN p.category_3 = 'Hummus' THEN 'Dips'
+            WHEN p.category_3 = 'Ranch Dip' THEN 'Dips'
+            WHEN p.category_3 = 'Dip Mixes' THEN 'Dips'
+            WHEN p.category_3 = 'Salsa' THEN 'Salsa'
+            WHEN p.category_3 = 'Other Dips' THEN 'Dips'
+            WHEN p.category_3 = 'Guacamole' THEN 'Salsa'
+            WHEN p.category_3 = 'French Onion Dip' THEN 'Dips'
+            WHEN p.category_3 = 'Cheese Dip' THEN 'Dips'
+            WHEN p.category_3 = 'Bean Dip' THEN 'Dips'
+            WHEN p.category_3 = 'Dessert Dips' THEN 'Dips'
+        END) AS sub_category,
+        COUNT(t.barcode) AS total_receipts,
+        SUM(t.final_sale) AS total_sales,
+        (SUM(t.final_sale)/COUNT(t.receipt_id)) AS avg_sales_per_receipt,
+        SUM(t.final_quantity) AS total_qty,
+        (SUM(t.final_sale)/SUM(t.final_quantity)) AS avg_sales_per_qty,
+        COUNT(t.user_id) AS total_users,
+        COUNT(bu.count_users) AS users_in_table,
+        COUNT(DISTINCT(t.user_id)) AS distinct_users
+    FROM TRANSACTION_TAKEHOME t
+        LEFT JOIN PRODUCTS_TAKEHOME p ON t.barcode = p.barcode
+        LEFT JOIN barcode_users bu ON t.barcode = bu.barcode
+    WHERE p.category_2 = 'Dips & Salsa' 
+        AND t.final_quantity > 0
+        AND brand IS NOT NULL
+    GROUP BY p.brand
+    ORDER BY total_sales DESC, 
+        total_qty DESC
+    """ 
+)
+
+# Original query with a correlated subquery for users_in_table, kept to 
+# check SQL_QUERY against.
+SQL_QUERY_CORRELATED = alch.text(
+    """
+    SELECT p.brand,
+        MAX(CASE
+            WHEN p.category_3 = 'Hummus' THEN 'Dips'
+            WHEN p.category_3 = 'Ranch Dip' THEN 'Dips'
+            WHEN p.category_3 = 'Dip Mixes' THEN 'Dips'
+            WHEN p.category_3 = 'Salsa' THEN 'Salsa'
+            WHEN p.category_3 = 'Other Dips' THEN 'Dips'
+            WHEN p.category_3 = 'Guacamole' THEN 'Salsa'
+            WHEN p.category_3 = 'French Onion Dip' THEN 'Dips'
+            WHEN p.category_3 = 'Cheese Dip' THEN 'Dips'
+            WHEN p.category_3 = 'Bean Dip' THEN 'Dips'
+            WHEN p.category_3 = 'Dessert Dips' THEN 'Dips'
+        END) AS sub_category,
+        COUNT(t.barcode) AS total_receipts,
+        SUM(t.final_sale) AS total_sales,
+        (SUM(t.final_sale)/COUNT(t.receipt_id)) AS avg_sales_per_receipt,
+        SUM(t.final_quantity) AS total_qty,
+        (SUM(t.final_sale)/SUM(t.final_quantity)) AS avg_sales_per_qty,
+        COUNT(t.user_id) AS total_users,
+        COUNT((SELECT u.id FROM USER_TAKEHOME u 
+            LEFT JOIN TRANSACTION_TAKEHOME t2 ON u.id = t2.user_id 
+            WHERE t2.barcode = t.barcode)) AS users_in_table,
+        COUNT(DISTINCT(t.user_id)) AS distinct_users
+    FROM TRANSACTION_TAKEHOME t
+        LEFT JOIN PRODUCTS_TAKEHOME p ON t.barcode = p.barcode
+    WHERE p.category_2 = 'Dips & Salsa' 
+        AND t.final_quantity > 0
+        AND brand IS NOT NULL
+    GROUP BY p.brand
+    ORDER BY total_sales DESC, 
+        total_qty DESC
+    """ 
+)
+
+# Same query over the fact table, which already joins products and users.
+SQL_QUERY_FACT = alch.text(
+    f"""
+    WITH barcode_users AS (
+        SELECT barcode,
+            COUNT(DISTINCT user_table_id) AS count_users
+        FROM {exercise_util.FACT_TABLE}
+        WHERE category_2 = 'Dips & Salsa'
+            AND user_table_id IS NOT NULL
+        GROUP BY barcode
+    )
+    SELECT f.brand,
+        MAX(CASE
+            WHEN f.category_3 = 'Hummus' THEN 'Dips'
+            WHEN f.category_3 = 'Ranch Dip' THEN 'Dips'
+            WHEN f.category_3 = 'Dip Mixes' THEN 'Dips'
+            WHEN f.category_3 = 'Salsa' THEN 'Salsa'
+            WHEN f.category_3 = 'Other Dips' THEN 'Dips'
+            WHEN f.category_3 = 'Guacamole' THEN 'Salsa'
+            WHEN f.category_3 = 'French Onion Dip' THEN 'Dips'
+            WHEN f.category_3 = 'Cheese Dip' THEN 'Dips'
+            WHEN f.category_3 = 'Bean Dip' THEN 'Dips'
+            WHEN f.category_3 = 'Dessert Dips' THEN 'Dips'
+        END) AS sub_category,
+        COUNT(f.barcode) AS total_receipts,
+        SUM(f.final_sale) AS total_sales,
+        (SUM(f.final_sale)/COUNT(f.receipt_id)) AS avg_sales_per_receipt,
+        SUM(f.final_quantity) AS total_qty,
+        (SUM(f.final_sale)/SUM(f.final_quantity)) AS avg_sales_per_qty,
+        COUNT(f.user_id) AS total_users,
+        COUNT(bu.count_users) AS users_in_table,
+        COUNT(DISTINCT(f.user_id)) AS distinct_users
+    FROM {exercise_util.FACT_TABLE} f
+        LEFT JOIN barcode_users bu ON f.barcode = bu.barcode
+    WHERE f.category_2 = 'Dips & Salsa' 
+        AND f.final_quantity > 0
+        AND f.brand IS NOT NULL
+    GROUP BY f.brand
+    ORDER BY total_sales DESC, 
+        total_qty DESC
+    """
+)
+
 """
 Query SQL database for the following with one query:
     Which is the leading brand in the Dips & Salsa category?
@@ -15,61 +147,21 @@ def run_query(engine):
     
     print('Running query for Open-Ended, Question 2..')
     with engine.connect() as conn:
-    
-        # define "generation" as what year they're born into
-        # qualified transactions... remove questionables
-        # from qualified transactions... get total sales 
-        # group by sum of sales after grouping by generation
-    
-        # Generational defintion taken from: 
-        # https://libguides.usc.edu/busdem/ag
-        sql_query = alch.text(
-            """
-            SELECT p.brand,
-                CASE
-                    WHEN p.category_3 = 'Hummus' THEN 'Dips'
-                    WHEN p.category_3 = 'Ranch Dip' THEN 'Dips'
-                    WHEN p.category_3 = 'Dip Mixes' THEN 'Dips'
-                    WHEN p.category_3 = 'Salsa' THEN 'Salsa'
-                    WHEN p.category_3 = 'Other Dips' THEN 'Dips'
-                    WHEN p.category_3 = 'Guacamole' THEN 'Salsa'
-                    WHEN p.category_3 = 'French Onion Dip' THEN 'Dips'
-                    WHEN p.category_3 = 'Cheese Dip' THEN 'Dips'
-                    WHEN p.category_3 = 'Bean Dip' THEN 'Dips'
-                    WHEN p.category_3 = 'Dessert Dips' THEN 'Dips'
-                END AS sub_category,
-                COUNT(t.barcode) AS total_receipts,
-                SUM(t.final_sale) AS total_sales,
-                (SUM(t.final_sale)/COUNT(t.receipt_id)) AS avg_sales_per_receipt,
-                SUM(t.final_quantity) AS total_qty,
-                (SUM(t.final_sale)/SUM(t.final_quantity)) AS avg_sales_per_qty,
-                COUNT(t.user_id) AS total_users,
-                COUNT((SELECT u.id FROM USER_TAKEHOME u 
-                    LEFT JOIN TRANSACTION_TAKEHOME t2 ON u.id = t2.user_id 
-                    WHERE t2.barcode = t.barcode)) AS users_in_table,
-                COUNT(DISTINCT(t.user_id)) AS distinct_users
-            FROM TRANSACTION_TAKEHOME t
-                LEFT JOIN PRODUCTS_TAKEHOME p ON t.barcode = p.barcode
-            WHERE p.category_2 = 'Dips & Salsa' 
-                AND t.final_quantity > 0
-                AND brand IS NOT NULL
-            GROUP BY p.brand
-            ORDER BY total_sales DESC, 
-                total_qty DESC
-            """ 
-        )
         
-        # Execute query to database and crate 
-        df_query_result = pd.DataFrame(
-            conn.execute(sql_query).fetchall()
-        )
+        sql_query = SQL_QUERY
+        
+        # Single-table version of the query over the fact table
+        if exercise_util.use_fact_table(conn):
+            sql_query = SQL_QUERY_FACT
+        
+        # Execute query to database, or read from cache if unchanged
+        df_query_result = exercise_util.cached_query(conn, sql_query)
      
         # Print results in console.
         print(tab.tabulate(df_query_result, 
                             headers=df_query_result.columns.values, 
                             tablefmt='simple_outline',
                             showindex=False))
-        engine.dispose()
  
     
     # Create a bar chart based on the results.
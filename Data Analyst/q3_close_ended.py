@@ -1,11 +1,36 @@
 #!/usr/bin/env python3
 import exercise_util
 import sqlalchemy as alch
-import pandas as pd
 import plotly.express as px
 import tabulate as tab
 
 
+# Same query over the fact table, where birth year, generation and age at
+# scan are precomputed. category_1 is filtered to one value, so MAX only 
+# keeps it valid where selected columns must be grouped (DuckDB, MySQL).
+SQL_QUERY_FACT = alch.text(
+    f"""
+    SELECT MAX(category_1) AS major_category,
+        COUNT(user_table_id) AS count_users,
+        generation,
+        SUM(final_sale) AS total_sales,
+        SUM(final_sale) /(
+            SELECT SUM(final_sale)
+            FROM {exercise_util.FACT_TABLE}
+            WHERE (age_at_scan > 17)
+                AND (birth_year > 1907)
+                AND (category_1 = 'Health & Wellness')
+        ) * 100 AS percent_total_sale
+    FROM {exercise_util.FACT_TABLE}
+    WHERE (age_at_scan > 17)
+        AND (birth_year > 1907)
+        AND (category_1 = 'Health & Wellness')
+    GROUP BY generation, 
+        generation_order
+    ORDER BY generation_order
+    """
+)
+
 """
 Query SQL database for the following with one query:
     What is the percentage of sales in the Health & Wellness 
@@ -23,8 +48,11 @@ def run_query(engine):
     
         # Generational defintion taken from: 
         # https://libguides.usc.edu/busdem/ag
+        birth_year = exercise_util.sql_function(conn, 'year', 'u.birth_date')
+        age_at_scan = exercise_util.sql_function(
+            conn, 'years_between', 't.scan_date', 'u.birth_date')
         sql_query = alch.text(
-            """
+            f"""
             WITH qualified_user_transactions AS (
                 SELECT t.barcode,
                     t.final_sale,
@@ -32,29 +60,27 @@ def run_query(engine):
                     u.id,
                     u.birth_date,
                     CASE
-                        WHEN CAST(STRFTIME('%Y', u.birth_date) AS int) 
+                        WHEN {birth_year} 
                             BETWEEN 1900 AND 1924 THEN 'The Greatest Generation'
-                        WHEN CAST(STRFTIME('%Y', u.birth_date) AS int) 
+                        WHEN {birth_year} 
                             BETWEEN 1925 AND 1945 THEN 'The Silent Generation'
-                        WHEN CAST(STRFTIME('%Y', u.birth_date) AS int) 
+                        WHEN {birth_year} 
                             BETWEEN 1946 AND 1964 THEN 'Baby Boomers'
-                        WHEN CAST(STRFTIME('%Y', u.birth_date) AS int) 
+                        WHEN {birth_year} 
                             BETWEEN 1965 AND 1979 THEN 'Generation X'
-                        WHEN CAST(STRFTIME('%Y', u.birth_date) AS int) 
+                        WHEN {birth_year} 
                             BETWEEN 1980 AND 1994 THEN 'Millennials'
-                        WHEN CAST(STRFTIME('%Y', u.birth_date) AS int) 
+                        WHEN {birth_year} 
                             BETWEEN 1995 AND 2012 THEN 'Generation Z'
-                        WHEN CAST(STRFTIME('%Y', u.birth_date) AS int) 
+                        WHEN {birth_year} 
                             BETWEEN 2013 AND 2025 THEN 'Gen Alpha'
                     END AS generation
                 FROM TRANSACTION_TAKEHOME t
                     LEFT JOIN USER_TAKEHOME u ON t.user_id = u.id
-                WHERE (
-                        CAST(TIMEDIFF(t.scan_date, u.birth_date) AS int) > 17
-                    )
-                    AND (CAST(STRFTIME('%Y', u.birth_date) AS int) > 1907)
+                WHERE ({age_at_scan} > 17)
+                    AND ({birth_year} > 1907)
             )
-            SELECT p.category_1 AS major_category,
+            SELECT MAX(p.category_1) AS major_category,
                 COUNT(q_ut.id) AS count_users,
                 generation,
                 SUM(q_ut.final_sale) AS total_sales,
@@ -66,7 +92,7 @@ def run_query(engine):
                 ) * 100 AS percent_total_sale
             FROM qualified_user_transactions q_ut
                 LEFT JOIN PRODUCTS_TAKEHOME p ON q_ut.barcode = p.barcode
-            WHERE major_category = 'Health & Wellness'
+            WHERE p.category_1 = 'Health & Wellness'
             GROUP BY generation
             ORDER BY 
                 CASE
@@ -82,17 +108,18 @@ def run_query(engine):
             """ 
         )
         
-        # Execute query to database and crate 
-        df_query_result = pd.DataFrame(
-            conn.execute(sql_query).fetchall()
-        )
+        # Single-table version of the query over the fact table
+        if exercise_util.use_fact_table(conn):
+            sql_query = SQL_QUERY_FACT
+        
+        # Execute query to database, or read from cache if unchanged
+        df_query_result = exercise_util.cached_query(conn, sql_query)
      
         # Print results in console.
         print(tab.tabulate(df_query_result, 
                         headers=df_query_result.columns.values, 
                         tablefmt='psql',
                         showindex=False))
-        engine.dispose()
     
     # Create a pie chart based on the results.    
     fig = px.pie(
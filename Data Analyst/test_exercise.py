@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+import os
+import pandas as pd
+import pytest
+import sqlalchemy as alch
+import exercise_benchmark
+import exercise_util
+import exercise_util_qc as qc
+import q2_open_ended
+from exercise_benchmark import QUERY_MODULES
+
+# Rows per table of the synthetic data the tests build.
+N_ROWS = 2000
+
+'''
+Synthetic CSV in a temporary directory, with its staging area next to it
+and no query cache. PATH_CSV, PATH_STAGING and PATH_CACHE are restored
+after the tests of the module.
+'''
+@pytest.fixture(scope="module")
+def source_csv(tmp_path_factory):
+    path = tmp_path_factory.mktemp("source")
+    exercise_benchmark.generate_source_csv(str(path / "csv") + os.sep, N_ROWS)
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(exercise_util, "PATH_CSV", str(path / "csv") + os.sep)
+        patch.setattr(exercise_util, "PATH_STAGING", str(path / "staging"))
+        patch.setattr(exercise_util, "PATH_CACHE", None)
+        yield path
+
+# SQLite database created from the synthetic CSV.
+@pytest.fixture(scope="module")
+def sample_db(source_csv):
+    engine_url = f"sqlite:///{source_csv / 'sample.db'}"
+    exercise_util.create_sample_db(engine_url, workers=1)
+    engine = alch.create_engine(engine_url)
+    yield engine
+    engine.dispose()
+
+    # Shared engines of the tests, e.g. of the DuckDB copy
+    for engine_url in [url for url in exercise_util.ENGINES 
+                       if str(source_csv) in url]:
+        exercise_util.ENGINES.pop(engine_url).dispose()
+
+# The set-based q2_open_ended query returns the rows of the correlated one.
+def test_q2_open_ended_set_based(sample_db):
+    with sample_db.connect() as conn:
+        df_corr = pd.read_sql(q2_open_ended.SQL_QUERY_CORRELATED, conn)
+        df_set = pd.read_sql(q2_open_ended.SQL_QUERY, conn)
+
+    assert len(df_set) > 0
+    pd.testing.assert_frame_equal(df_corr, df_set, check_dtype=False)
+
+# QC in the lean dtype mode keeps the values of the default mode in less
+# memory.
+@pytest.mark.parametrize("table", list(exercise_util.TABLES))
+def test_lean_dtypes(source_csv, monkeypatch, table):
+    results = {}
+    for mode in ["default", "lean"]:
+        monkeypatch.setattr(qc, "DTYPE_MODE", mode)
+        results[mode] = exercise_util.qc_source_csv(table)
+    df_default, df_lean = results["default"], results["lean"]
+
+    assert qc.get_memory(df_lean) < qc.get_memory(df_default)
+    pd.testing.assert_frame_equal(
+        df_default.astype(object).where(df_default.notna(), None),
+        df_lean.astype(object).where(df_lean.notna(), None))
+
+# Rows of every loaded table, in a fixed order.
+def read_tables(engine_url):
+    engine = alch.create_engine(engine_url)
+    with engine.connect() as conn:
+        tables = {table: pd.read_sql(alch.text(
+            f"SELECT * FROM {table} ORDER BY 1, 2, 3"), conn)
+            for table in exercise_util.TABLES.keys()}
+    engine.dispose()
+    return tables
+
+'''
+A database created again from the same CSV loads the staged tables without
+cleaning the CSV, and holds the same tables as the one loaded from CSV.
+'''
+def test_staged_load(source_csv, monkeypatch):
+    monkeypatch.setattr(exercise_util, "PATH_STAGING", 
+                        str(source_csv / "staging_load"))
+    
+    csv_url = f"sqlite:///{source_csv / 'load_csv.db'}"
+    exercise_util.create_sample_db(csv_url, workers=1)
+    for table in exercise_util.TABLES.keys():
+        assert exercise_util.read_staging_info(
+            table, exercise_util.fingerprint_csv(table)) is not None
+    
+    def qc_source_csv(table, workers=1):
+        raise AssertionError(f"{table} was cleaned again")
+    monkeypatch.setattr(exercise_util, "qc_source_csv", qc_source_csv)
+    staged_url = f"sqlite:///{source_csv / 'load_staged.db'}"
+    exercise_util.create_sample_db(staged_url, workers=1)
+    
+    tables_csv, tables_staged = read_tables(csv_url), read_tables(staged_url)
+    for table in exercise_util.TABLES.keys():
+        assert len(tables_csv[table]) > 0
+        pd.testing.assert_frame_equal(tables_csv[table], tables_staged[table])
+
+'''
+Every question returns the same rows, in any order of ties, on the SQLite 
+database and on its DuckDB copy, with and without the fact table.
+'''
+@pytest.mark.parametrize("fact", [True, False])
+@pytest.mark.parametrize("module", QUERY_MODULES, 
+                         ids=[module.__name__ for module in QUERY_MODULES])
+def test_duckdb_backend(sample_db, source_csv, monkeypatch, module, fact):
+    pytest.importorskip("duckdb_engine")
+    monkeypatch.setattr(exercise_util, "DUCKDB_PATH", 
+                        str(source_csv / "sample.duckdb"))
+    monkeypatch.setattr(exercise_util, "USE_FACT_TABLE", fact)
+    duckdb_engine = exercise_util.get_duckdb_engine(
+        sample_db.url.render_as_string(hide_password=False))
+    
+    results = {}
+    for backend, engine in [("sqlite", sample_db), ("duckdb", duckdb_engine)]:
+        df, _ = module.run_query(engine)
+        results[backend] = df.sort_values(
+            list(df.columns)).reset_index(drop=True)
+    
+    assert len(results["sqlite"]) > 0
+    pd.testing.assert_frame_equal(results["sqlite"], results["duckdb"], 
+                                  check_dtype=False)
+
+'''
+A query result is cached as one complete Parquet file and read back the 
+same. A query that reads no loaded table is never cached, as nothing would
+invalidate it.
+'''
+def test_cached_query(sample_db, source_csv, monkeypatch):
+    path_cache = source_csv / "cache"
+    monkeypatch.setattr(exercise_util, "PATH_CACHE", str(path_cache))
+    
+    with sample_db.connect() as conn:
+        df_query = exercise_util.cached_query(conn, q2_open_ended.SQL_QUERY)
+        df_cached = exercise_util.cached_query(conn, q2_open_ended.SQL_QUERY)
+        exercise_util.cached_query(conn, alch.text("SELECT 1 AS one"))
+    
+    assert [path.suffix for path in path_cache.iterdir()] == [".parquet"]
+    pd.testing.assert_frame_equal(df_query, df_cached)
+
+'''
+Duplicate groups of every table are reconciled to the same rows by the 
+columnar arrays as by sub_recur on rows as pd.Series.
+'''
+@pytest.mark.parametrize("table", list(exercise_util.TABLES))
+def test_reconcile_modes(source_csv, monkeypatch, table):
+    df_tbl = qc.qc_table(exercise_util.read_source_csv(table), table)
+    
+    results = {}
+    for mode in ["series", "columnar"]:
+        monkeypatch.setattr(qc, "RECONCILE_MODE", mode)
+        results[mode] = qc.qc_by_row(df_tbl.copy(), table)
+    
+    assert len(results["columnar"]) < len(df_tbl)
+    pd.testing.assert_frame_equal(results["series"], results["columnar"])
+
+'''
+A refresh after rows are appended to every CSV gives the tables of a full
+build from the whole CSV. A second refresh of unchanged content, with only
+the modification times updated, keeps the load times in the manifest so 
+cached results stay valid.
+'''
+def test_refresh_append(source_csv, monkeypatch):
+    path_csv = source_csv / "csv_append"
+    path_csv.mkdir()
+    monkeypatch.setattr(exercise_util, "PATH_CSV", str(path_csv) + os.sep)
+    monkeypatch.setattr(exercise_util, "PATH_STAGING", 
+                        str(source_csv / "staging_append"))
+    
+    # First 70% of the rows of each table, then all of them
+    lines = {}
+    for table in exercise_util.TABLES.keys():
+        with open(source_csv / "csv" / f"{table}.csv", "rb") as f:
+            lines[table] = f.readlines()
+    
+    def write_csv(share):
+        for table, arr_lines in lines.items():
+            c_lines = 1 + int((len(arr_lines) - 1) * share)
+            with open(path_csv / f"{table}.csv", "wb") as f:
+                f.writelines(arr_lines[:c_lines])
+    
+    refresh_url = f"sqlite:///{source_csv / 'refresh.db'}"
+    write_csv(0.7)
+    exercise_util.create_sample_db(refresh_url, workers=1)
+    write_csv(1)
+    exercise_util.refresh_sample_db(refresh_url, workers=1)
+    
+    full_url = f"sqlite:///{source_csv / 'full.db'}"
+    exercise_util.create_sample_db(full_url, workers=1)
+    
+    tables_refresh, tables_full = read_tables(refresh_url), read_tables(full_url)
+    for table in exercise_util.TABLES.keys():
+        columns = list(tables_full[table].columns)
+        pd.testing.assert_frame_equal(
+            tables_refresh[table].sort_values(columns, ignore_index=True), 
+            tables_full[table].sort_values(columns, ignore_index=True))
+    
+    # Same content written again only updates the modification time
+    engine = exercise_util.get_engine(refresh_url)
+    manifest = exercise_util.read_manifest(engine)
+    write_csv(1)
+    for table, row in manifest.items():
+        os.utime(path_csv / f"{table}.csv", (row["mtime"] + 10,) * 2)
+    exercise_util.refresh_sample_db(refresh_url, workers=1)
+    manifest_touched = exercise_util.read_manifest(engine)
+    exercise_util.ENGINES.pop(refresh_url).dispose()
+    
+    for table, row in manifest.items():
+        assert manifest_touched[table]["loaded_at"] == row["loaded_at"]
+        assert manifest_touched[table]["sha256"] == row["sha256"]
+        assert manifest_touched[table]["mtime"] == row["mtime"] + 10